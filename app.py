@@ -1,15 +1,25 @@
-from flask import Flask, render_template, redirect, url_for, request, Response, jsonify, send_from_directory, has_request_context
+from flask import Flask, render_template, redirect, url_for, request, Response, jsonify, send_file, has_request_context, g
 import log_sensors
-import csv
+import metrics
+from frame_broadcaster import FrameBroadcaster
+from capture_process import CaptureProcess
+from frame_pipeline import FramePipeline
+import hardware
+from comment_journal import CommentJournal, csv_chunks, journal_path, merged_rows, read_rows
+from downloads import stream_download
+from frame_timestamps import FrameTimestampIndex, sidecar_path
+from run_format import RunReader, check_run_file, parse_timestamp, run_path
+from run_catalog import RunCatalog, file_size
+from run_index import index_path, read_range
+from sample_buffer import format_sample, sse_event
 import os
-import cv2
 import threading
-import queue
 import time
 import logging
 import heapq
+import math
+import zlib
 from threading import Lock
-from datetime import datetime
 
 
 # Define a filter to suppress specific route logs
@@ -17,7 +27,7 @@ class NoLoggingFilter(logging.Filter):
     def filter(self, record):
         # Check if the request context is active before trying to access `request.path`
         if has_request_context():
-            return request.path != '/get_latest_data'
+            return request.path not in ('/get_latest_data', '/stream', '/metrics', '/status')
         return True
 
 # Apply this filter to the werkzeug logger
@@ -26,86 +36,147 @@ werkzeug_logger.addFilter(NoLoggingFilter())
 werkzeug_logger.setLevel(logging.WARNING)  # Adjust the log level as needed
 app = Flask(__name__)
 
+request_seconds = metrics.Histogram('mw_http_request_seconds',
+                                    "Time to handle a request; for streams, until the response starts", ['route'])
+requests_total = metrics.Counter('mw_http_requests_total', "Requests handled", ['route', 'status'])
+comment_flush_seconds = metrics.Histogram('mw_comment_flush_seconds', "Time to append one batch of comments to the journal")
+
+# Pipeline and scheduler state, read when /metrics is scraped
+metrics.Gauge('mw_record_queue_depth', "Frames waiting for the video writer",
+              lambda: logger.pipeline.stats().get('record_queue_depth', float('NaN')))
+metrics.Gauge('mw_frames_record_dropped', "Frames the recording stage refused",
+              lambda: logger.pipeline.stats().get('frames_record_dropped', float('NaN')))
+metrics.Gauge('mw_frames_preview_dropped', "Frames replaced before the preview stage took them",
+              lambda: logger.pipeline.stats().get('frames_preview_dropped', float('NaN')))
+metrics.Gauge('mw_video_viewers', "Clients watching /video_feed", lambda: logger.broadcaster.viewers)
+metrics.Gauge('mw_stream_clients', "Clients subscribed to /stream", lambda: log_sensors.sample_hub.client_count())
+metrics.Gauge('mw_sample_overruns', "Samples of the current run that overran their period",
+              lambda: log_sensors.scheduler.overruns if log_sensors.scheduler is not None else 0)
+
+profiler = metrics.SamplingProfiler()  # Started and stopped from /profiler
+
 class Logger:
-    def __init__(self):
+    def __init__(self, preview_width=640, preview_quality=80, preview_max_fps=15.0, catalog=None,
+                 capture_process=False, camera=True):
         self.log_file_name = None
         self.video_file_name = None
         self.logging_active = False
-        self.providing_frames = True  # Always provide frames for live feed
-        self.video_writer = None
-        self.cap = cv2.VideoCapture(0)  # Start capturing as soon as Logger is created
-        self.frame_thread = None
-        self.frame_queue = queue.Queue()
+        self.broadcaster = FrameBroadcaster()  # Latest encoded frame, shared by every viewer
+        self.preview_settings = {'preview_width': preview_width, 'preview_quality': preview_quality,
+                                 'preview_max_fps': preview_max_fps}
+        self.capture_process = capture_process  # Run capture and encoding in a worker process
+        self.cap = None
+        self.pipeline = None  # Capture, recording and preview stages; started when the camera is first needed
+        self.frame_index = None  # Timestamp lookup into the current video, loaded on first use
+        self.comment_journal = None  # Append-only comment store of the current run
+        self.catalog = catalog  # Run catalog driving retention; optional
+        self.run_id = None  # Catalog id of the current run
         self.comments = {}
-        self.frame_times = []
-        self.comment_queue = queue.Queue()  # Queue to hold comments to be added
 
         # Use a list to represent the priority queue and a lock for thread safety
         self.comment_queue = []  # Priority queue implemented as a list
         self.comment_lock = Lock()  # Lock for thread-safe access
+        self.comment_counter = 0  # Tie-breaker that keeps edits to the same row in arrival order
+        self.comment_processing_thread = None  # Started with the first run or comment
+
+        # The camera is a registry device, so it is opened on first use and reported on /hardware
+        hardware.registry.register('camera', self.open_pipeline, self.close_pipeline, enabled=camera)
+
+    def open_pipeline(self):
+        if self.capture_process:
+            # The worker process opens the camera itself
+            pipeline = CaptureProcess(self.broadcaster, **self.preview_settings, on_failure=self.camera_failed)
+            pipeline.start()
+            if not pipeline.running:
+                raise RuntimeError("Capture process did not start")
+            return pipeline
+        cap = hardware.open_camera()
+        if not cap.isOpened():
+            raise RuntimeError("Failed to open camera")
+        self.cap = cap
+        pipeline = FramePipeline(cap, self.broadcaster, **self.preview_settings, on_failure=self.camera_failed)
+        pipeline.start()
+        return pipeline
+
+    def camera_failed(self, error):
+        # Closes the pipeline; the camera is reopened on first use after the retry interval
+        hardware.registry.fail('camera', error)
+
+    def close_pipeline(self, pipeline):
+        # Stops the capture, recording and preview stages; this also finishes any recording
+        pipeline.stop()
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+            print("Camera released in cleanup.")
 
-        self.has_setup_writer = False
-
-        # Start the frame generation thread immediately
-        if self.cap.isOpened():
-            self.frame_thread = threading.Thread(target=self.gen_frames, daemon=True)  # Daemonize the thread
-            self.frame_thread.start()
-            #self.gen_frames()  # Run gen_frames directly without threading
-            print("Live stream thread started.")
-        else:
-            print("Failed to open camera on initialization.")
+    def video_pipeline(self):
+        # The running frame pipeline, or None while the camera is disabled or unavailable
+        self.pipeline = hardware.registry.get('camera')
+        return self.pipeline
 
+    def start_comment_processing(self):
         # Start a separate thread to process queued comments every few seconds
-        self.comment_processing_thread = threading.Thread(target=self.process_comment_queue, daemon=True)
-        self.comment_processing_thread.start()
-
-    def start_logging(self, power_setting, catalyst, microwave_duration):
-        self.log_file_name = f"{power_setting}_{catalyst}_{microwave_duration}_sensor_log.csv"
+        if self.comment_processing_thread is None:
+            self.comment_processing_thread = threading.Thread(target=self.process_comment_queue, daemon=True)
+            self.comment_processing_thread.start()
+
+    def start_logging(self, power_setting, catalyst, microwave_duration, sample_period=2.0):
+        # A reused run name appends to its run file, which needs the same settings; raises ValueError otherwise.
+        # Checked first, so a refused start leaves the current run alone.
+        log_file_name = f"{power_setting}_{catalyst}_{microwave_duration}_sensor_log.csv"
+        check_run_file(run_path(log_file_name), log_sensors.no_of_thermistors, sample_period)
+        if self.logging_active:
+            self.stop_logging()
+        self.log_file_name = log_file_name
         self.video_file_name = f"{power_setting}_{catalyst}_{microwave_duration}_video.mp4"
+        if self.catalog is not None:
+            # Registered as active first, so retention never touches the files being written
+            self.run_id = self.catalog.start_run(self.run_files(), power_setting, catalyst, microwave_duration)
         self.comments.clear()
+        self.frame_index = None
+        self.comment_journal = CommentJournal(self.log_file_name)
         self.logging_active = True
-        self.has_setup_writer = False  # Reset the writer setup flag
-        log_sensors.start_logging(self.log_file_name)
+        self.start_comment_processing()
+        pipeline = self.video_pipeline()
+        if pipeline is not None:
+            pipeline.start_recording(self.video_file_name)
+        else:
+            print("Camera unavailable; logging sensors without video.")
+        log_sensors.start_logging(self.log_file_name, sample_period)
 
     def stop_logging(self):
         log_sensors.stop_logging()
         self.logging_active = False
 
-        # Release video writer
-        if self.video_writer is not None:
-            self.video_writer.release()
-            self.video_writer = None
-            self.has_setup_writer = False
-            print("Video writer released in stop_logging.")
+        # Wait for the recording stage to write the queued frames and release the video writer
+        if self.pipeline is not None:
+            self.pipeline.stop_recording()
 
-        # Clear frame times to avoid inconsistent frame rates
-        self.frame_times.clear()
+        if self.catalog is not None and self.run_id is not None:
+            self.catalog.finish_run(self.run_id)
+            self.run_id = None
 
-        # Add a small delay to ensure resources are flushed correctly
-        time.sleep(2)
-
-        if self.video_file_name:
+        if self.video_file_name and self.pipeline is not None:
             print(f"Video saved in file: {self.video_file_name}")
 
         print("Logging stopped and resources cleaned up.")
 
-    def calculate_frame_rate(self):
-        if len(self.frame_times) < 2:
-            return 30.0
-        total_time = self.frame_times[-1] - self.frame_times[0]
-        average_frame_rate = len(self.frame_times) / total_time if total_time > 0 else 30.0
-        return max(min(average_frame_rate, 30.0), 1.0)  # Ensure frame rate is at least 1.0
+    def run_files(self):
+        # Every file the current run writes
+        return [self.log_file_name, index_path(self.log_file_name), run_path(self.log_file_name),
+                journal_path(self.log_file_name), self.video_file_name, sidecar_path(self.video_file_name)]
 
     def log_comment(self, timestamp, comment):
         try:
-            # Convert timestamp string to a datetime object
-            timestamp_dt = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
-            # Convert datetime to Unix time
-            timestamp_epoch = timestamp_dt.timestamp()
+            # Convert the row's timestamp string to Unix time
+            timestamp_epoch = parse_timestamp(timestamp)
 
             with self.comment_lock:
                 # Use `heapq.heappush` to maintain the priority queue order with the epoch timestamp
-                heapq.heappush(self.comment_queue, (timestamp_epoch, comment))
+                self.comment_counter += 1
+                heapq.heappush(self.comment_queue, (timestamp_epoch, self.comment_counter, timestamp, comment))
+            self.start_comment_processing()
 
             # print(f"Comment queued for timestamp {timestamp}")
 
@@ -122,7 +193,7 @@ class Logger:
                         comments_to_process.append(heapq.heappop(self.comment_queue))  # Pop the earliest item
 
                 if comments_to_process:
-                    self.batch_update_comments_in_file(comments_to_process)
+                    self.append_comments_to_journal(comments_to_process)
                     # print(f"Processed a batch of {len(comments_to_process)} comments inside process comment queue.")
 
                 time.sleep(2)  # Process every 2 seconds
@@ -130,151 +201,95 @@ class Logger:
             except Exception as e:
                 print(f"Error while processing comments: {e}")
 
-    def batch_update_comments_in_file(self, comments):
+    def append_comments_to_journal(self, comments):
         try:
-            if self.log_file_name:
-                # Read all rows from the CSV file
-                with open(self.log_file_name, mode='r+', newline='') as file:
-                    reader = csv.reader(file)
-                    rows = list(reader)
-
-                    # Create a dictionary for quick lookup of new comments
-                    comment_dict = {
-                        datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S'): comment
-                        for timestamp, comment in comments
-                    }
-
-                    # Update rows with comments
-                    for row in rows:
-                        if len(row) > 0 and row[0] in comment_dict:
-                            if len(row) < 11:
-                                row.extend([''] * (11 - len(row)))
-                            row[10] = comment_dict[row[0]]  # Add/replace the comment
-
-                    # Write back the updated rows to the CSV file
-                    file.seek(0)
-                    writer = csv.writer(file)
-                    writer.writerows(rows)
-                    file.truncate()
+            if self.comment_journal is not None:
+                # Keep only the latest edit of each row; the sensor log itself is never touched
+                comment_dict = {timestamp: comment for _, _, timestamp, comment in comments}
+                with comment_flush_seconds.time():
+                    self.comment_journal.append(comment_dict.items())
 
                 print(f"Batch of {len(comments)} comments processed.")
 
         except Exception as e:
             print(f"Error updating comments in batch: {e}")
 
-    def gen_frames(self):
-        if not self.cap.isOpened():
-            print("Camera is not opened in gen_frames.")
-            return
-
-        frame_count = 0
-        try:
-            while self.providing_frames:
-                success, frame = self.cap.read()
-                if not success:
-                    print("Failed to capture frame.")
-                    break
-
-                current_time = time.time()
-                self.frame_times.append(current_time)
-                if len(self.frame_times) > 30:
-                    self.frame_times.pop(0)
-
-                # Setup video writer if logging has started
-                if self.logging_active and not self.has_setup_writer:
-                    try:
-                        dynamic_frame_rate = self.calculate_frame_rate()
-                        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-                        self.video_writer = cv2.VideoWriter(self.video_file_name, fourcc, dynamic_frame_rate,
-                                                            (640, 480))
-                        self.has_setup_writer = True
-                        print(f"Video writer initialized for recording at {dynamic_frame_rate} fps")
-                    except Exception as e:
-                        print(f"Error initializing video writer: {e}")
-                        break
-
-                # Write frame if logging
-                if self.logging_active and self.video_writer is not None:
-                    try:
-                        self.video_writer.write(frame)
-                        frame_count += 1
-                        time.sleep(0.01)  # Small delay to help sync
-                    except Exception as e:
-                        print(f"Error writing frame: {e}")
-                        break
-
-                # Convert frame to JPEG and queue it for the live feed
-                try:
-                    ret, buffer = cv2.imencode('.jpg', frame)
-                    if not ret:
-                        print("Failed to encode frame to JPEG.")
-                        continue
-                    frame = buffer.tobytes()
-                    self.frame_queue.put(frame)
-                except Exception as e:
-                    print(f"Error encoding or queuing frame: {e}")
-                    break
-
-            print(f"Finished capturing {frame_count} frames during logging.")
-
-        except Exception as e:
-            print(f"Error in gen_frames: {e}")
-
-        finally:
-            if self.video_writer is not None:
-                self.video_writer.release()
-                self.video_writer = None
-                print("Video writer released in gen_frames cleanup.")
-            self.has_setup_writer = False
-            print("Exiting gen_frames.")
+    def find_frame(self, timestamp):
+        # Returns (frame index, playback position in seconds) of the recorded frame closest to `timestamp`
+        if self.frame_index is None:
+            self.frame_index = FrameTimestampIndex(sidecar_path(self.video_file_name))
+        else:
+            self.frame_index.refresh()
+        frame = self.frame_index.nearest_frame(timestamp)
+        if frame is None:
+            return None, None
+        return frame, self.frame_index.playback_position(frame)
 
     def get_frame(self):
-        while True:
-            frame = self.frame_queue.get()
+        for frame in self.broadcaster.frames():
             yield (b'--frame\r\n'
                    b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
 
     def cleanup(self):
-        # Stop providing frames and ensure the frame generation thread stops
-        self.providing_frames = False
-
-        # Join the frame thread with a longer timeout to ensure it completes
-        if self.frame_thread is not None:
-            self.frame_thread.join(timeout=5)  # Increase timeout
-            print("Frame thread joined successfully.")
-
-        # Release the video writer, ensuring it is flushed
-        if self.video_writer is not None:
-            self.video_writer.release()
-            self.video_writer = None  # Explicitly set to None
-            print("Video writer released in cleanup.")
-
-        # Release the camera resource
-        if self.cap is not None and self.cap.isOpened():
-            self.cap.release()
-            self.cap = None  # Explicitly set to None
-            print("Camera released in cleanup.")
+        if self.logging_active:
+            self.stop_logging()
+
+        # Close every opened device: the camera (and its pipeline), the SPI handles and GPIO
+        hardware.registry.close_all()
+        self.pipeline = None
 
-        # Clear the frame queue
-        with self.frame_queue.mutex:
-            self.frame_queue.queue.clear()
-            print("Frame queue cleared in cleanup.")
+        # Wake up and disconnect any remaining viewers
+        self.broadcaster.close()
+        print("Frame broadcaster closed in cleanup.")
 
         print("Cleanup completed.")
 
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    if 'request_start' in g:
+        request_seconds.labels(route).observe(time.perf_counter() - g.request_start)
+    requests_total.labels(route, response.status_code).inc()
+    return response
+
+
+PAGE_SIZE = 50  # Rows per page of the recorded data table
+MIN_SAMPLE_PERIOD = 0.1  # Seconds
+MAX_SAMPLE_PERIOD = 3600.0
+
 @app.route('/')
 def index():
-    data = []
-    try:
-        if logger.log_file_name is not None:
-            with open(logger.log_file_name, newline='') as csvfile:
-                reader = csv.reader(csvfile)
-                data = list(reader)
-    except FileNotFoundError:
-        data = []
-
-    return render_template('index.html', data=data)
+    # Only the newest page is rendered, straight from memory; older pages are fetched from /rows
+    buffer = log_sensors.sample_buffer
+    run = buffer.run_start_seq
+    data, last_seq = buffer.tail(PAGE_SIZE)
+    first_row = max(last_seq - run - len(data), 0)  # Position of data[0] within the run
+    comments = logger.comment_journal.load() if logger.comment_journal is not None else {}
+    comments = {row[0]: comments[row[0]] for row in data if row[0] in comments}
+    return render_template('index.html', data=data, seq=last_seq, run=run, first_row=first_row, comments=comments)
+
+@app.route('/rows')
+def rows_page():
+    # Page of older rows of the current run, ending just before the `before` cursor
+    before = request.args.get('before', type=int)
+    limit = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), 500)
+    if before is None or not logger.log_file_name or not os.path.exists(run_path(logger.log_file_name)):
+        return jsonify(rows=[], comments={}, before=0)
+
+    # The cursor counts from the start of the current run; a reused run name appends to the same file
+    reader = RunReader(run_path(logger.log_file_name))
+    first = log_sensors.run_start_record
+    before = min(before, len(reader) - first)
+    start = max(before - limit, 0)
+    rows = [format_sample(row[0], row[1:-1]) for row in reader.rows(first + start, first + before)]
+    comments = logger.comment_journal.load() if logger.comment_journal is not None else {}
+    comments = {row[0]: comments[row[0]] for row in rows if row[0] in comments}
+    return jsonify(rows=rows, comments=comments, before=start)
 
 @app.route('/start', methods=['POST'])
 def start_logging():
@@ -286,7 +301,16 @@ def start_logging():
     # Combine minutes and seconds into a single duration string
     microwave_duration = f"{microwave_duration_minutes}m_{microwave_duration_seconds}s"
 
-    logger.start_logging(power_setting, catalyst, microwave_duration)
+    # Seconds between sensor samples; sub-second periods are supported
+    sample_period = request.form.get('sample_period', type=float) or 2.0
+    if not math.isfinite(sample_period):
+        return "Sample period must be a number of seconds", 400
+    sample_period = min(max(sample_period, MIN_SAMPLE_PERIOD), MAX_SAMPLE_PERIOD)
+
+    try:
+        logger.start_logging(power_setting, catalyst, microwave_duration, sample_period)
+    except ValueError as e:
+        return str(e), 400
     return redirect(url_for('index'))
 
 @app.route('/stop', methods=['POST'])
@@ -296,31 +320,131 @@ def stop_logging():
 
 @app.route('/video_feed')
 def video_feed():
+    if logger.video_pipeline() is None:
+        return "Camera not available", 503
     return Response(logger.get_frame(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/video_stats')
+def video_stats():
+    return jsonify(logger.pipeline.stats() if logger.pipeline is not None else {})
+
+@app.route('/status')
+def status():
+    # Current per-channel statistics and alarm states, maintained as samples arrive
+    return jsonify(logging_active=log_sensors.logging_active, seq=log_sensors.sample_buffer.last_seq,
+                   **log_sensors.channel_monitor.status())
+
+@app.route('/alarms', methods=['GET', 'POST'])
+def alarms():
+    # POST a JSON list of alarms, e.g. [{"channel": "Thermocouple", "kind": "above", "limit": 400}], to replace them
+    if request.method == 'POST':
+        try:
+            log_sensors.channel_monitor.set_alarms(request.get_json(force=True))
+        except (ValueError, TypeError) as e:
+            return f"Invalid alarms: {e}", 400
+    return jsonify(log_sensors.channel_monitor.status()['alarms'])
+
+@app.route('/hardware')
+def hardware_status():
+    # State of every device: idle (not opened yet), ok, unavailable (with the error) or disabled
+    return jsonify(hardware.registry.status())
+
+@app.route('/sensor_stats')
+def sensor_stats():
+    return jsonify(log_sensors.stats())
+
 @app.route('/get_latest_data')
 def get_latest_data():
-    data = []
-    try:
-        if logger.log_file_name is not None:
-            with open(logger.log_file_name, newline='') as csvfile:
-                reader = csv.reader(csvfile)
-                data = list(reader)
-    except FileNotFoundError:
-        data = []
-
-    if len(data) > 1:
-        data_without_headers = data[1:]
+    # Served from the in-memory sample buffer, so the cost does not grow with the run length
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify(log_sensors.sample_buffer.latest(10))
+
+    # Cursor mode: only return the samples logged after the client's last sequence number
+    buffer = log_sensors.sample_buffer
+    etag = f"{buffer.run_start_seq}-{buffer.last_seq}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
     else:
-        data_without_headers = []
+        rows, last_seq, truncated = buffer.since(since)
+        response = jsonify(run=buffer.run_start_seq, seq=last_seq, truncated=truncated, rows=rows)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/history')
+def history():
+    # Downsampled min/max/mean series of the current run for whole-run plots
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        start = parse_timestamp(start) if start else None
+        end = parse_timestamp(end) if end else None
+    except ValueError as e:
+        return f"Invalid time range: {e}", 400
+    points = min(max(request.args.get('points', 500, type=int), 1), 5000)
+    return jsonify(log_sensors.history.query(start, end, points))
+
+@app.route('/range')
+def read_log_range():
+    # Stream the rows of the current (or an archived) run between two timestamps
+    log_file_name = request.args.get('log') or logger.log_file_name
+    if log_file_name:
+        log_file_name = os.path.basename(log_file_name)  # Only runs in the working directory
+    if not log_file_name or not (os.path.exists(log_file_name) or os.path.exists(run_path(log_file_name))):
+        return "Log file not found", 404
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        start = parse_timestamp(start) if start else None
+        end = parse_timestamp(end) if end else None
+    except ValueError as e:
+        return f"Invalid time range: {e}", 400
+    channels = request.args.get('channels')
+    channels = channels.split(',') if channels else None
+    return Response(csv_chunks(read_range(log_file_name, start, end, channels)), mimetype='text/csv')
+
+@app.route('/stream')
+def stream():
+    # Server-Sent Events push stream; reconnecting clients resume from Last-Event-ID
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    buffer = log_sensors.sample_buffer
+    hub = log_sensors.sample_hub
+    subscription = hub.subscribe()
+
+    def generate():
+        try:
+            yield "retry: 2000\n\n"
+            if since is not None:
+                # Backfill the samples the client missed from the in-memory buffer
+                rows, last_seq, _ = buffer.since(since)
+                first_seq = last_seq - len(rows) + 1
+                yield "".join(sse_event(first_seq + i, buffer.run_start_seq, row) for i, row in enumerate(rows))
+
+            while True:
+                messages = subscription.get_all(timeout=15)
+                yield "".join(messages) if messages else ": keepalive\n\n"
+        finally:
+            hub.unsubscribe(subscription)
 
-    rounded_data = []
-    for row in data_without_headers:
-        if len(row) > 1:  # Ensure row has enough elements
-            rounded_row = [row[0]] + [f"{float(x):.2f}" if x.replace('.', '', 1).isdigit() else x for x in row[1:-1]]
-            rounded_data.append(rounded_row)
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-    return jsonify(rounded_data[-10:])
+@app.route('/frame_at')
+def frame_at():
+    # Maps a sensor log timestamp to the matching moment in the recorded video
+    timestamp = request.args.get('timestamp')
+    if not timestamp or not logger.video_file_name or not os.path.exists(sidecar_path(logger.video_file_name)):
+        return "Frame timestamps not found", 404
+    try:
+        frame, position = logger.find_frame(timestamp)
+    except ValueError as e:
+        return f"Invalid timestamp: {e}", 400
+    if frame is None:
+        return "No frames recorded yet", 404
+    return jsonify(frame=frame, position=position)
 
 @app.route('/add_comment', methods=['POST'])
 def add_comment():
@@ -329,57 +453,98 @@ def add_comment():
     logger.log_comment(timestamp, comment)
     return jsonify(success=True)
 
+@app.route('/runs')
+def list_runs():
+    if logger.catalog is None:
+        return jsonify([])
+    return jsonify(logger.catalog.runs())
+
 @app.route('/download_log')
 def download_log():
-    if logger.log_file_name and os.path.exists(logger.log_file_name):
-        directory = os.path.dirname(os.path.abspath(logger.log_file_name))
-        return send_from_directory(directory=directory, path=os.path.basename(logger.log_file_name), as_attachment=True)
-    return "Log file not found", 404
+    if not logger.log_file_name:
+        return "Log file not found", 404
+
+    # The CSV is generated from the binary run file when there is one, and the
+    # comments are merged in while it is streamed out. The snapshot taken here
+    # (record count and journal size) makes the export repeatable, so it can be
+    # downloaded in ranges and resumed even while the run is still being written.
+    journal_size = file_size(journal_path(logger.log_file_name))
+    comments = CommentJournal(logger.log_file_name).load()
+    # The URL serves whichever run is current, so the ETag also names the run: its file and
+    # first sample (or the CSV's inode), so two runs with the same length never share one
+    if os.path.exists(run_path(logger.log_file_name)):
+        reader = RunReader(run_path(logger.log_file_name))
+        snapshot, make_rows = len(reader), reader.csv_rows
+        run = reader.records['time_ns'][0] if snapshot else 0
+    elif os.path.exists(logger.log_file_name):
+        snapshot, make_rows = file_size(logger.log_file_name), lambda: read_rows(logger.log_file_name)
+        run = os.stat(logger.log_file_name).st_ino
+    else:
+        return "Log file not found", 404
+    if logger.catalog is not None:
+        logger.catalog.touch(logger.log_file_name)
+
+    run_id = zlib.crc32(f"{os.path.basename(logger.log_file_name)}:{run}".encode())
+    return stream_download(request, lambda: csv_chunks(merged_rows(make_rows(), comments)),
+                           os.path.basename(logger.log_file_name), f"{run_id:08x}-{snapshot}-{journal_size}")
 
 @app.route('/download_video')
 def download_video():
+    # Served with Range support, so browsers can seek and resume the MP4
     if logger.video_file_name and os.path.exists(logger.video_file_name):
-        directory = os.path.dirname(os.path.abspath(logger.video_file_name))
-        filename = os.path.basename(logger.video_file_name)
-        return send_from_directory(directory=directory, path=filename, as_attachment=True, mimetype='video/x-msvideo')
+        if logger.catalog is not None:
+            logger.catalog.touch(logger.video_file_name)
+        return send_file(os.path.abspath(logger.video_file_name), mimetype='video/mp4', as_attachment=True,
+                         conditional=True)
     return "Video file not found", 404
 
-def start_cleanup_thread(directory, interval_minutes=1):
+@app.route('/metrics')
+def metrics_page():
+    # Prometheus text exposition format
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/profiler', methods=['GET', 'POST'])
+def profiler_page():
+    # POST action=start|stop|reset toggles the sampling profiler; GET returns the folded stacks
+    if request.method == 'POST':
+        action = request.form.get('action')
+        if action == 'start':
+            profiler.start()
+        elif action == 'stop':
+            profiler.stop()
+        elif action == 'reset':
+            profiler.reset()
+        else:
+            return "Unknown action", 400
+        return jsonify(running=profiler.running, samples=profiler.samples)
+    limit = request.args.get('limit', type=int)
+    return Response(profiler.report(limit), mimetype='text/plain')
+
+def start_cleanup_thread(catalog, interval_minutes=1):
     """
-    Start a background thread that removes old files every `interval_minutes`.
+    Start a background thread that applies the run catalog's retention policy every `interval_minutes`.
     """
     def cleanup_task():
         while True:
-            remove_old_files(directory)
+            try:
+                catalog.enforce_retention()
+            except Exception as e:
+                print(f"Error while enforcing retention: {e}")
             time.sleep(interval_minutes * 60)
 
     cleanup_thread = threading.Thread(target=cleanup_task)
     cleanup_thread.daemon = True  # Daemonize thread to exit when the main program does
     cleanup_thread.start()
 
-def remove_old_files(directory, max_age_minutes=10):
-    """
-    Remove files older than `max_age_minutes` from the specified directory.
-    """
-    current_time = time.time()
-    max_age_seconds = max_age_minutes * 60
-
-    for filename in os.listdir(directory):
-        file_path = os.path.join(directory, filename)
-        if os.path.isfile(file_path) and (filename.endswith('.csv') or filename.endswith('.mp4')):
-            file_creation_time = os.path.getctime(file_path)
-            if current_time - file_creation_time > max_age_seconds:
-                try:
-                    os.remove(file_path)
-                    print(f"Removed old file: {file_path}")
-                except Exception as e:
-                    print(f"Error while deleting file {file_path}: {e}")
-
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
     log_directory = os.path.dirname(os.path.abspath(__file__))  # Assuming logs are in the same directory as app.py
-    start_cleanup_thread(log_directory)
+    catalog = RunCatalog(os.path.join(log_directory, 'runs.db'))
+    start_cleanup_thread(catalog)
 
-    logger = Logger()
+    # MW_CAPTURE_PROCESS=1 runs the camera and video encoding in their own process; MW_CAMERA=0 disables it
+    logger = Logger(catalog=catalog, capture_process=os.environ.get('MW_CAPTURE_PROCESS') == '1',
+                    camera=os.environ.get('MW_CAMERA', '1') != '0')
 
     try:
         app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,268 @@
+"""
+Headless benchmark of the logging service on simulated hardware (see simulators.py).
+
+Reports sample-loop jitter, frames per second captured, written and encoded,
+the latency and throughput of /get_latest_data, / and /rows as the number of
+clients and the length of the run grow, and /video_feed throughput. Runs on
+any Linux box:
+
+    python benchmark.py --duration 5 --clients 1 4 16 --log-lengths 0 10000 100000 --json results.json
+"""
+import os
+
+os.environ['MW_HARDWARE'] = 'sim'  # Must be set before log_sensors is imported
+
+import argparse
+import contextlib
+import http.client
+import io
+import json
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+import app
+import log_sensors
+import simulators
+from comment_journal import CommentJournal
+from run_format import RunWriter, format_timestamp, run_path
+from thermistor import codes_to_temperature
+
+
+def progress(message):
+    print(message, file=sys.stderr)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def latency_summary(latencies, errors, duration):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_second': len(latencies) / duration,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': max(latencies, default=0.0) * 1000,
+    }
+
+
+# --- Sampling loop ---
+
+def bench_sampling(directory, duration, sample_period):
+    log_sensors.start_logging(os.path.join(directory, 'bench_sensor_log.csv'), sample_period)
+    time.sleep(duration)
+    log_sensors.stop_logging()
+    return log_sensors.stats()
+
+
+# --- Frame pipeline ---
+
+def bench_frames(logger, directory, duration):
+    # A viewer is attached for the whole run, otherwise the preview stage never encodes
+    pipeline = logger.video_pipeline()
+    stop = threading.Event()
+
+    def view():
+        frames = logger.broadcaster.frames()
+        for _ in frames:
+            if stop.is_set():
+                break
+        frames.close()
+
+    viewer = threading.Thread(target=view, daemon=True)
+    viewer.start()
+
+    before = pipeline.stats()
+    pipeline.start_recording(os.path.join(directory, 'bench_video.mp4'))
+    time.sleep(duration)
+    pipeline.stop_recording()
+    after = pipeline.stats()
+    stop.set()
+    viewer.join(timeout=5)
+
+    result = {key: after[key] - before[key] for key in after if key != 'record_queue_depth'}
+    for stage in ('captured', 'written', 'encoded'):
+        result[f'{stage}_fps'] = result[f'frames_{stage}'] / duration
+    return result
+
+
+# --- HTTP endpoints ---
+
+def fill_run(logger, directory, length):
+    # A run of `length` one-second samples, as if it had been logging for a while: written to a
+    # run file the logger points at, so routes that read the log pay for its length
+    log_file_name = os.path.join(directory, f'bench_{length}_sensor_log.csv')
+    log_sensors.sample_buffer.clear()
+    log_sensors.history.clear()
+    log_sensors.channel_monitor.clear()
+    run_writer = RunWriter(run_path(log_file_name), log_sensors.no_of_thermistors, 1.0)
+    log_sensors.run_start_record = run_writer.first_record
+    start_ns = time.time_ns() - length * 1_000_000_000
+    codes = [500.0] * log_sensors.no_of_thermistors
+    readings = codes_to_temperature(codes).tolist() + [25.0]
+    for i in range(length):
+        time_ns = start_ns + i * 1_000_000_000
+        run_writer.append(time_ns, codes, 25.0)
+        log_sensors.publish_sample(format_timestamp(time_ns, 1.0), readings, time_ns)
+    run_writer.close()
+    logger.log_file_name = log_file_name
+    logger.comment_journal = CommentJournal(log_file_name)
+
+
+def bench_polling(port, clients, duration, path='/get_latest_data'):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        own = []
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 400:
+                    raise http.client.HTTPException(response.status)
+                own.append(time.perf_counter() - start)
+            except (OSError, http.client.HTTPException):
+                with lock:
+                    errors[0] += 1
+                connection.close()
+        connection.close()
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latency_summary(latencies, errors[0], duration)
+
+
+def bench_video_feed(port, clients, duration):
+    results = []
+    lock = threading.Lock()
+
+    def client():
+        start = time.perf_counter()
+        deadline = start + duration
+        first_frame, frames, received = None, 0, 0
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        try:
+            connection.request('GET', '/video_feed')
+            response = connection.getresponse()
+            while time.perf_counter() < deadline:
+                chunk = response.read1(65536)
+                if not chunk:
+                    break
+                received += len(chunk)
+                frames += chunk.count(b'--frame')
+                if frames and first_frame is None:
+                    first_frame = time.perf_counter() - start
+        except OSError:
+            pass
+        finally:
+            connection.close()
+        with lock:
+            results.append((first_frame, frames, received))
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    first_frames = [first for first, _, _ in results if first is not None]
+    return {
+        'clients_served': len(first_frames),
+        'fps_per_client': statistics.mean(frames for _, frames, _ in results) / duration,
+        'megabytes_per_second': sum(received for _, _, received in results) / duration / 1e6,
+        'first_frame_ms': statistics.mean(first_frames) * 1000 if first_frames else None,
+    }
+
+
+def print_table(title, rows):
+    print(f"\n{title}")
+    for label, values in rows:
+        print(f"  {label:<28}" + "  ".join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}"
+                                       for key, value in values.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=5.0, help="Seconds per measurement")
+    parser.add_argument('--sample-period', type=float, default=0.1, help="Sensor sample period in seconds")
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--log-lengths', type=int, nargs='+', default=[0, 10000, 100000],
+                        help="Samples already in the run when the polled routes are measured")
+    parser.add_argument('--replay-sensors', help="Sensor log (.mwrun or CSV) to replay instead of synthetic data")
+    parser.add_argument('--replay-video', help="Video file to replay instead of the test pattern")
+    parser.add_argument('--capture-process', action='store_true', help="Run capture and encoding in a worker process")
+    parser.add_argument('--json', help="Also write the results to this file")
+    parser.add_argument('--verbose', action='store_true', help="Show the service's own output")
+    args = parser.parse_args()
+
+    simulators.config['sensor_replay'] = args.replay_sensors or simulators.config['sensor_replay']
+    simulators.config['camera_replay'] = args.replay_video or simulators.config['camera_replay']
+    results = {'config': {**vars(args), 'simulators': dict(simulators.config)}}
+
+    with tempfile.TemporaryDirectory() as directory, \
+            contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+        progress("Sample loop...")
+        results['sampling'] = bench_sampling(directory, args.duration, args.sample_period)
+
+        logger = app.Logger(capture_process=args.capture_process)
+        app.logger = logger
+        server = make_server('127.0.0.1', 0, app.app, threaded=True)
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        try:
+            progress("Frame pipeline...")
+            results['frames'] = bench_frames(logger, directory, args.duration)
+
+            results['polling'] = {}
+            for length in args.log_lengths:
+                fill_run(logger, directory, length)
+                # The newest samples, the page view, and the page of rows just before it
+                for path in ('/get_latest_data', '/', f'/rows?before={max(length - app.PAGE_SIZE, 0)}'):
+                    route = path.split('?')[0]
+                    for clients in args.clients:
+                        progress(f"{route}: {length} samples, {clients} clients...")
+                        results['polling'].setdefault(route, {})[f'{length} samples, {clients} clients'] = \
+                            bench_polling(server.server_port, clients, args.duration, path)
+
+            results['video_feed'] = {}
+            for clients in args.clients:
+                progress(f"/video_feed: {clients} clients...")
+                results['video_feed'][f'{clients} clients'] = bench_video_feed(server.server_port, clients,
+                                                                               args.duration)
+        finally:
+            server.shutdown()
+            logger.cleanup()
+
+    print_table("Sample loop", [('', results['sampling'])])
+    print_table("Frame pipeline", [('', results['frames'])])
+    for route, route_results in results['polling'].items():
+        print_table(route, route_results.items())
+    print_table("/video_feed", results['video_feed'].items())
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
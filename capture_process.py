@@ -0,0 +1,280 @@
+import multiprocessing
+import struct
+import threading
+from multiprocessing import shared_memory
+
+from frame_pipeline import FramePipeline
+from hardware import open_camera
+
+# Shared-memory ring layout: a 64-byte header (latest sequence number, viewer count, slot count,
+# slot size) followed by `slots` slots of a 16-byte slot header (sequence number, length) and up to
+# `slot_size` bytes of encoded frame. A slot's sequence number is cleared while it is rewritten,
+# so readers can tell a frame they copied was not overwritten halfway through.
+HEADER = struct.Struct('<4Q32x')
+SLOT_HEADER = struct.Struct('<2Q')
+COUNTER = struct.Struct('<Q')
+
+
+class FrameRing:
+    """
+    Ring of encoded frames in shared memory, written by one process and read by
+    another. Readers get memoryviews straight into the shared block, so a frame
+    is only copied when the reader decides to keep it.
+    """
+    def __init__(self, memory, owner):
+        self.memory = memory
+        self.owner = owner  # The creating side unlinks the block when closed
+        _, _, self.slots, self.slot_size = HEADER.unpack_from(memory.buf, 0)
+        self.dropped = 0  # Frames too large for a slot
+
+    @classmethod
+    def create(cls, slots=4, slot_size=1024 * 1024):
+        memory = shared_memory.SharedMemory(create=True, size=HEADER.size + slots * (SLOT_HEADER.size + slot_size))
+        HEADER.pack_into(memory.buf, 0, 0, 0, slots, slot_size)
+        return cls(memory, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def slot_offset(self, seq):
+        return HEADER.size + (seq % self.slots) * (SLOT_HEADER.size + self.slot_size)
+
+    def latest(self):
+        return COUNTER.unpack_from(self.memory.buf, 0)[0]
+
+    def viewers(self):
+        return COUNTER.unpack_from(self.memory.buf, 8)[0]
+
+    def set_viewers(self, count):
+        COUNTER.pack_into(self.memory.buf, 8, count)
+
+    def write(self, frame):
+        if len(frame) > self.slot_size:
+            self.dropped += 1
+            return
+        seq = self.latest() + 1
+        offset = self.slot_offset(seq)
+        SLOT_HEADER.pack_into(self.memory.buf, offset, 0, 0)
+        start = offset + SLOT_HEADER.size
+        self.memory.buf[start:start + len(frame)] = frame
+        SLOT_HEADER.pack_into(self.memory.buf, offset, seq, len(frame))
+        COUNTER.pack_into(self.memory.buf, 0, seq)
+
+    def view(self, seq):
+        # Zero-copy view of frame `seq`, or None if it has been overwritten; check valid() after using it
+        offset = self.slot_offset(seq)
+        slot_seq, length = SLOT_HEADER.unpack_from(self.memory.buf, offset)
+        if slot_seq != seq:
+            return None
+        start = offset + SLOT_HEADER.size
+        return self.memory.buf[start:start + length]
+
+    def valid(self, seq):
+        return SLOT_HEADER.unpack_from(self.memory.buf, self.slot_offset(seq))[0] == seq
+
+    def read(self, seq):
+        # Copy of frame `seq`, or None if the writer got to its slot first
+        view = self.view(seq)
+        if view is None:
+            return None
+        try:
+            frame = bytes(view)
+        finally:
+            view.release()
+        return frame if self.valid(seq) else None
+
+    def close(self):
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+class RingPublisher:
+    """Stands in for the FrameBroadcaster inside the worker process."""
+    def __init__(self, ring, frame_ready):
+        self.ring = ring
+        self.frame_ready = frame_ready  # Wakes the parent's reader instead of having it poll the ring
+
+    def publish(self, frame):
+        self.ring.write(frame)
+        self.frame_ready.set()
+
+    def has_viewers(self):
+        return self.ring.viewers() > 0
+
+
+def worker_main(ring_name, frame_ready, connection, preview_width, preview_quality, preview_max_fps):
+    # Runs the camera, the video writer and the preview encoder in the worker process
+    ring = FrameRing.attach(ring_name)
+    cap = open_camera()
+    if not cap.isOpened():
+        connection.send(('error', "Failed to open camera on initialization."))
+        ring.close()
+        return
+    pipeline = FramePipeline(cap, RingPublisher(ring, frame_ready), preview_width=preview_width,
+                             preview_quality=preview_quality, preview_max_fps=preview_max_fps)
+    pipeline.start()
+    connection.send(('started', None))
+
+    try:
+        while True:
+            if not connection.poll(0.5):
+                if pipeline.capture_failed:
+                    break  # Exiting tells the parent the camera is gone
+                continue
+            try:
+                command, argument = connection.recv()
+            except EOFError:
+                break  # The parent went away
+            if command == 'start_recording':
+                pipeline.start_recording(argument)
+                connection.send(('ok', None))
+            elif command == 'stop_recording':
+                pipeline.stop_recording(argument)
+                connection.send(('ok', None))
+            elif command == 'stats':
+                connection.send(('ok', {**pipeline.stats(), 'frames_too_large': ring.dropped}))
+            elif command == 'stop':
+                break
+    finally:
+        pipeline.stop()
+        cap.release()
+        ring.close()
+        try:
+            connection.send(('stopped', None))
+        except (BrokenPipeError, OSError):
+            pass
+
+
+class CaptureProcess:
+    """
+    Runs the FramePipeline (capture, recording and preview encoding) in a worker
+    process so it has a core and a GIL of its own, away from the sensor loop and
+    the Flask handlers. Encoded preview frames come back through a FrameRing and
+    are handed to the local FrameBroadcaster; start/stop and stats go over a pipe.
+    Offers the FramePipeline methods Logger uses, so the two are interchangeable.
+    """
+    def __init__(self, broadcaster, preview_width=640, preview_quality=80, preview_max_fps=15.0,
+                 slots=4, slot_size=1024 * 1024, on_failure=None):
+        self.broadcaster = broadcaster
+        self.on_failure = on_failure  # Called with the error when the worker exits on its own
+        self.preview_settings = (preview_width, preview_quality, preview_max_fps)
+        self.slots = slots
+        self.slot_size = slot_size
+        self.context = multiprocessing.get_context('spawn')  # No inherited threads or camera handles
+        self.ring = None
+        self.frame_ready = None  # Set by the worker after each frame it writes to the ring
+        self.process = None
+        self.connection = None
+        self.connection_lock = threading.Lock()
+        self.reader_thread = None
+        self.recording = False
+        self.stopping = False
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.is_alive()
+
+    def start(self, timeout=15):
+        self.stopping = False
+        self.ring = FrameRing.create(self.slots, self.slot_size)
+        self.frame_ready = self.context.Event()
+        self.connection, child_connection = self.context.Pipe()
+        self.process = self.context.Process(target=worker_main, name='capture',
+                                            args=(self.ring.name, self.frame_ready, child_connection, *self.preview_settings),
+                                            daemon=True)
+        self.process.start()
+        child_connection.close()
+
+        try:
+            reply = self.connection.recv() if self.connection.poll(timeout) else None
+        except EOFError:
+            reply = None  # The worker died before it could answer
+        if reply is None:
+            reply = ('error', "Capture process did not start.")
+        if reply[0] != 'started':
+            print(reply[1])
+            self.process.join(timeout=1)
+            self.close()
+            return
+        self.reader_thread = threading.Thread(target=self.read_loop, daemon=True)
+        self.reader_thread.start()
+        print(f"Capture process started (pid {self.process.pid}).")
+
+    def request(self, command, argument=None, timeout=5):
+        # Send a command to the worker and wait for its reply; None if it did not answer
+        if not self.running:
+            return None
+        with self.connection_lock:
+            try:
+                self.connection.send((command, argument))
+                if self.connection.poll(timeout):
+                    return self.connection.recv()[1]
+            except (EOFError, BrokenPipeError, OSError) as e:
+                print(f"Capture process unreachable: {e}")
+        print(f"Capture process did not answer '{command}'.")
+        return None
+
+    def start_recording(self, video_file_name):
+        self.recording = True
+        self.request('start_recording', video_file_name)
+
+    def stop_recording(self, timeout=5):
+        if not self.recording:
+            return
+        self.recording = False
+        self.request('stop_recording', timeout, timeout=timeout + 1)
+
+    def stats(self):
+        return self.request('stats', timeout=1) or {}
+
+    def read_loop(self):
+        # Hand new frames from the ring to the local viewers; the viewer count goes the other way
+        last_seq = 0
+        while self.running:
+            self.ring.set_viewers(self.broadcaster.viewers)
+            # Sleeps until the worker writes a frame; the timeout keeps the viewer count and liveness check current
+            if not self.frame_ready.wait(0.1):
+                continue
+            self.frame_ready.clear()  # Before reading, so a frame written meanwhile sets it again
+            seq = self.ring.latest()
+            if seq != last_seq:
+                frame = self.ring.read(seq)
+                if frame is not None:
+                    self.broadcaster.publish(frame)
+                last_seq = seq
+        if not self.stopping and self.on_failure is not None:
+            self.on_failure("Capture process exited")
+
+    def stop(self, timeout=5):
+        self.stopping = True
+        if self.running:
+            self.stop_recording(timeout)
+            with self.connection_lock:
+                try:
+                    self.connection.send(('stop', None))
+                    if self.connection.poll(timeout):
+                        self.connection.recv()
+                except (EOFError, BrokenPipeError, OSError):
+                    pass
+            self.process.join(timeout=timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+        if self.reader_thread is not None and self.reader_thread is not threading.current_thread():
+            self.reader_thread.join(timeout=1)
+            self.reader_thread = None
+        self.close()
+        print("Capture process stopped.")
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
@@ -0,0 +1,231 @@
+import math
+import threading
+from collections import deque
+
+
+class WindowedStats:
+    """
+    Min, max and mean of the values seen in the last `window` seconds, updated in
+    amortized O(1) per value: a running sum for the mean and monotonic deques
+    whose fronts are the current minimum and maximum.
+    """
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()  # (time, value)
+        self.minima = deque()  # Increasing values; the front is the minimum
+        self.maxima = deque()  # Decreasing values; the front is the maximum
+        self.total = 0.0
+        self.additions = 0
+
+    def add(self, time_s, value):
+        self.values.append((time_s, value))
+        self.total += value
+        while self.minima and self.minima[-1][1] >= value:
+            self.minima.pop()
+        self.minima.append((time_s, value))
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.maxima.append((time_s, value))
+        self.expire(time_s)
+
+        # Re-sum now and then so rounding errors of the running sum cannot build up
+        self.additions += 1
+        if self.additions % 4096 == 0:
+            self.total = math.fsum(value for _, value in self.values)
+
+    def expire(self, now):
+        cutoff = now - self.window
+        while self.values and self.values[0][0] <= cutoff:
+            self.total -= self.values.popleft()[1]
+        while self.minima and self.minima[0][0] <= cutoff:
+            self.minima.popleft()
+        while self.maxima and self.maxima[0][0] <= cutoff:
+            self.maxima.popleft()
+        if not self.values:
+            self.total = 0.0
+
+    def min(self):
+        return self.minima[0][1] if self.minima else math.nan
+
+    def max(self):
+        return self.maxima[0][1] if self.maxima else math.nan
+
+    def mean(self):
+        return self.total / len(self.values) if self.values else math.nan
+
+
+class ChannelStats:
+    """
+    Running statistics of one channel: the windowed min/max/mean, an EWMA with
+    time constant `tau` seconds, the rate of change in °C/s (smoothed the same
+    way) and how many readings were NaN, in total and in a row. NaN readings
+    (open circuit, missing sensor) are counted and otherwise skipped.
+    """
+    def __init__(self, window=60.0, tau=10.0):
+        self.window = WindowedStats(window)
+        self.tau = tau
+        self.value = math.nan  # Latest reading, NaN included
+        self.ewma = math.nan
+        self.rate = 0.0
+        self.samples = 0
+        self.nan_count = 0
+        self.nan_streak = 0
+        self.last_time = None
+        self.last_value = None  # Latest finite reading
+
+    def add(self, time_s, value):
+        self.samples += 1
+        self.value = value
+        if math.isnan(value):
+            self.nan_count += 1
+            self.nan_streak += 1
+            self.window.expire(time_s)
+            return
+        self.nan_streak = 0
+        self.window.add(time_s, value)
+
+        if self.last_time is None:
+            self.ewma = value
+        else:
+            dt = time_s - self.last_time
+            if dt > 0:
+                # Time-aware smoothing, so irregular sample periods weigh samples correctly
+                alpha = 1 - math.exp(-dt / self.tau)
+                self.ewma += alpha * (value - self.ewma)
+                self.rate += alpha * ((value - self.last_value) / dt - self.rate)
+        self.last_time = time_s
+        self.last_value = value
+
+    def snapshot(self):
+        return {
+            'value': finite(self.value),
+            'min': finite(self.window.min()),
+            'max': finite(self.window.max()),
+            'mean': finite(self.window.mean()),
+            'ewma': finite(self.ewma),
+            'rate': finite(self.rate) if self.last_time is not None else None,
+            'samples': self.samples,
+            'nan_count': self.nan_count,
+            'nan_streak': self.nan_streak,
+        }
+
+
+class Alarm:
+    """
+    Threshold on one channel, evaluated on every sample. Kinds:
+    'above' / 'below' compare the latest reading with `limit` (°C),
+    'rate_above' compares the rate of change (°C/s), and 'nan_streak' fires
+    after `limit` NaN readings in a row (e.g. an open thermocouple).
+    An active alarm clears once the value is back past the limit by `hysteresis`.
+    """
+    KINDS = ('above', 'below', 'rate_above', 'nan_streak')
+
+    def __init__(self, channel, kind, limit, hysteresis=0.0):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown alarm kind '{kind}'")
+        self.channel = channel
+        self.kind = kind
+        self.limit = float(limit)
+        self.hysteresis = float(hysteresis)
+        self.active = False
+        self.since = None  # Time of the last change of state
+        self.value = None  # Value that last triggered or cleared the alarm
+
+    def measure(self, stats):
+        if self.kind == 'rate_above':
+            return stats.rate if stats.last_time is not None else math.nan
+        if self.kind == 'nan_streak':
+            return stats.nan_streak
+        return stats.value
+
+    def evaluate(self, stats, time_s):
+        # Returns True when the alarm was raised or cleared by this sample
+        value = self.measure(stats)
+        if math.isnan(value):
+            return False  # No reading; keep the current state
+        if self.kind == 'below':
+            triggered, cleared = value < self.limit, value > self.limit + self.hysteresis
+        elif self.kind == 'nan_streak':
+            triggered, cleared = value >= self.limit, value == 0
+        else:
+            triggered, cleared = value > self.limit, value < self.limit - self.hysteresis
+        if not self.active and triggered:
+            self.active = True
+        elif self.active and cleared:
+            self.active = False
+        else:
+            return False
+        self.since = time_s
+        self.value = value
+        return True
+
+    def status(self):
+        return {'channel': self.channel, 'kind': self.kind, 'limit': self.limit, 'hysteresis': self.hysteresis,
+                'active': self.active, 'since': self.since, 'value': self.value}
+
+
+class ChannelMonitor:
+    """
+    Per-channel running statistics and alarms, updated as each sample is
+    published, so the current state of a run is always one cheap status() call
+    away and nobody has to re-read the log to compute it.
+    """
+    def __init__(self, channels, window=60.0, tau=10.0):
+        self.channels = channels
+        self.window_seconds = window
+        self.tau = tau
+        self.lock = threading.Lock()
+        self.stats = None
+        self.alarms = []
+        self.last_time = None
+        self.clear()
+
+    def clear(self):
+        # Statistics start over with each run; the alarm configuration stays
+        with self.lock:
+            self.stats = {channel: ChannelStats(self.window_seconds, self.tau) for channel in self.channels}
+            self.last_time = None
+            for alarm in self.alarms:
+                alarm.active, alarm.since, alarm.value = False, None, None
+
+    def set_alarms(self, configs):
+        # `configs` is a list of Alarm keyword-argument dicts; raises ValueError if one is invalid
+        alarms = []
+        for config in configs:
+            try:
+                alarm = Alarm(**config)
+            except TypeError as e:
+                raise ValueError(f"Invalid alarm {config}: {e}")
+            if alarm.channel not in self.channels:
+                raise ValueError(f"Unknown channel '{alarm.channel}'")
+            alarms.append(alarm)
+        with self.lock:
+            self.alarms = alarms
+
+    def add(self, time_s, values):
+        # Returns the alarms this sample raised or cleared
+        changed = []
+        with self.lock:
+            self.last_time = time_s
+            for channel, value in zip(self.channels, values):
+                self.stats[channel].add(time_s, value)
+            for alarm in self.alarms:
+                if alarm.evaluate(self.stats[alarm.channel], time_s):
+                    changed.append(alarm.status())
+        return changed
+
+    def status(self):
+        with self.lock:
+            alarms = [alarm.status() for alarm in self.alarms]
+            return {
+                'time': self.last_time,
+                'window': self.window_seconds,
+                'channels': {channel: stats.snapshot() for channel, stats in self.stats.items()},
+                'alarms': alarms,
+                'active_alarms': sum(alarm['active'] for alarm in alarms),
+            }
+
+
+def finite(value):
+    # JSON has no NaN or infinity
+    return value if math.isfinite(value) else None
@@ -0,0 +1,72 @@
+import csv
+import io
+import os
+import threading
+
+
+def journal_path(log_file_name):
+    return os.path.splitext(log_file_name)[0] + '_comments.csv'
+
+
+class CommentJournal:
+    """
+    Append-only journal of comments keyed by sample timestamp, kept next to the
+    sensor log. Adding comments never reads or rewrites the sensor log, so it
+    costs the same however long the run is and never blocks the sensor writer.
+    The latest entry for a timestamp wins when the journal is merged back in.
+    """
+    def __init__(self, log_file_name):
+        self.path = journal_path(log_file_name)
+        self.lock = threading.Lock()
+
+    def append(self, comments):
+        # `comments` is an iterable of (timestamp, comment) pairs
+        with self.lock, open(self.path, mode='a', newline='') as file:
+            csv.writer(file).writerows(comments)
+
+    def load(self):
+        comments = {}
+        try:
+            with self.lock, open(self.path, newline='') as file:
+                for row in csv.reader(file):
+                    if len(row) == 2:
+                        comments[row[0]] = row[1]
+        except FileNotFoundError:
+            pass
+        return comments
+
+
+def read_rows(log_file_name):
+    with open(log_file_name, newline='') as file:
+        yield from csv.reader(file)
+
+
+def merged_rows(rows, comments):
+    # Fill the journal's comments into the Comment column of the sensor log rows
+    for row in rows:
+        if len(row) > 0 and row[0] in comments:
+            if len(row) < 11:
+                row.extend([''] * (11 - len(row)))
+            row[10] = comments[row[0]]
+        yield row
+
+
+def csv_chunks(rows, rows_per_chunk=500):
+    # Generate CSV text in chunks so the whole log is never held in memory
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_csv(log_file_name, rows=None):
+    # Stream the sensor log (or the given rows of the same run) with the comments merged in
+    comments = CommentJournal(log_file_name).load()
+    if rows is None:
+        rows = read_rows(log_file_name)
+    return csv_chunks(merged_rows(rows, comments))
@@ -0,0 +1,81 @@
+import zlib
+
+from flask import Response
+from werkzeug.datastructures import ContentRange
+
+
+def encoded(chunks):
+    for chunk in chunks:
+        yield chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+
+
+def gzip_chunks(chunks, level=6):
+    # Compress a chunk stream on the fly; memory stays bounded by the chunk size
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 writes a gzip container
+    for chunk in encoded(chunks):
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def byte_slice(chunks, start, stop):
+    # Yield bytes [start, stop) of a chunk stream
+    position = 0
+    for chunk in encoded(chunks):
+        end = position + len(chunk)
+        if end > start:
+            yield chunk[max(start - position, 0):stop - position]
+        position = end
+        if position >= stop:
+            break
+
+
+def range_applies(if_range, etag):
+    # No If-Range, or one naming the current content; generated content has no Last-Modified to match
+    if if_range.etag is None and if_range.date is None:
+        return True
+    return if_range.etag == etag
+
+
+def stream_download(request, make_chunks, filename, etag, mimetype='text/csv'):
+    """
+    Stream generated content as a download. `make_chunks` must return the same
+    chunks every time it is called, and `etag` must change whenever they would
+    change.
+    - A Range request (with a matching If-Range, if one is sent) gets the
+      requested bytes as 206 Partial Content, so interrupted downloads resume.
+    - Otherwise the content is gzip-compressed on the fly for clients that
+      accept it, and sent as is for the rest. The gzip representation's ETag
+      is `etag` with a `-gz` suffix; ranges are always served uncompressed.
+    """
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"', 'Accept-Ranges': 'bytes',
+               'Vary': 'Accept-Encoding'}
+    ranged = request.range is not None and range_applies(request.if_range, etag)
+    gzipped = not ranged and 'gzip' in request.accept_encodings
+    # A strong validator must differ between content-codings, so the gzip representation gets its own
+    representation_etag = f"{etag}-gz" if gzipped else etag
+
+    if representation_etag in request.if_none_match:
+        response = Response(status=304, headers=headers)
+    elif ranged:
+        # The total length of generated content is only known after generating it once
+        length = sum(len(chunk) for chunk in encoded(make_chunks()))
+        byte_range = request.range.range_for_length(length)
+        if byte_range is None:
+            response = Response(status=416, headers=headers)
+            response.content_range = ContentRange('bytes', None, None, length)
+        else:
+            start, stop = byte_range
+            response = Response(byte_slice(make_chunks(), start, stop), status=206, mimetype=mimetype,
+                                headers=headers)
+            response.content_range = ContentRange('bytes', start, stop, length)
+            response.content_length = stop - start
+    elif gzipped:
+        response = Response(gzip_chunks(make_chunks()), mimetype=mimetype, headers=headers)
+        response.content_encoding = 'gzip'
+    else:
+        response = Response(encoded(make_chunks()), mimetype=mimetype, headers=headers)
+
+    response.set_etag(representation_etag)
+    return response
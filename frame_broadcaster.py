@@ -0,0 +1,58 @@
+import threading
+
+
+class FrameBroadcaster:
+    """
+    Holds only the latest encoded JPEG frame and wakes every viewer when a new
+    one arrives. Each viewer tracks the sequence number of the last frame it
+    sent, so slow viewers skip straight to the newest frame and memory stays
+    constant no matter how many (or how few) viewers are connected.
+    The number of connected viewers is tracked so the producer can skip
+    encoding entirely while nobody is watching.
+    """
+    def __init__(self):
+        self.frame = None
+        self.seq = 0
+        self.viewers = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def publish(self, frame):
+        with self.condition:
+            self.frame = frame
+            self.seq += 1
+            self.condition.notify_all()
+
+    def wait_for_frame(self, last_seq, timeout=5.0):
+        # Returns (seq, frame); seq equals last_seq if nothing new arrived before the timeout
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq != last_seq or self.closed, timeout)
+            return self.seq, self.frame
+
+    def has_viewers(self):
+        return self.viewers > 0
+
+    def frames(self):
+        with self.condition:
+            self.viewers += 1
+        try:
+            last_seq = 0
+            while not self.closed:
+                seq, frame = self.wait_for_frame(last_seq)
+                if seq == last_seq:
+                    continue
+                # Also move past a cleared frame, or wait_for_frame would return it again at once
+                last_seq = seq
+                if frame is not None:
+                    yield frame
+        finally:
+            with self.condition:
+                self.viewers -= 1
+                if self.viewers == 0:
+                    self.frame = None  # Don't show the next viewer a stale frame
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.frame = None
+            self.condition.notify_all()
@@ -0,0 +1,261 @@
+import threading
+import time
+from collections import deque
+
+import metrics
+from frame_timestamps import FrameTimestampWriter, sidecar_path
+
+capture_seconds = metrics.Histogram('mw_camera_read_seconds', "Time cap.read() blocks for one frame")
+video_write_seconds = metrics.Histogram('mw_video_write_seconds', "Time VideoWriter.write() takes per frame")
+preview_encode_seconds = metrics.Histogram('mw_preview_encode_seconds', "Time to scale and JPEG-encode one preview frame")
+
+
+class StageQueue:
+    """
+    Bounded hand-off queue between two pipeline stages with an explicit drop policy:
+    'drop_oldest' discards the oldest queued item to make room for the new one,
+    'drop_newest' refuses the new item. Either way the drop is counted.
+    """
+    def __init__(self, maxsize, policy='drop_oldest'):
+        self.items = deque()
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.condition = threading.Condition()
+
+    def put(self, item, force=False):
+        # `force` bypasses the bound; used for control markers that must not be lost
+        with self.condition:
+            if not force and len(self.items) >= self.maxsize:
+                self.dropped += 1
+                if self.policy == 'drop_newest':
+                    return False
+                self.items.popleft()
+            self.items.append(item)
+            self.condition.notify()
+            return True
+
+    def get(self, timeout=None):
+        # Returns None if nothing arrived before the timeout
+        with self.condition:
+            if not self.items:
+                self.condition.wait(timeout)
+            return self.items.popleft() if self.items else None
+
+    def __len__(self):
+        return len(self.items)
+
+
+class FramePipeline:
+    """
+    Staged camera pipeline: a capture thread reads frames as fast as the camera
+    delivers them and hands them to a recording stage (VideoWriter) and a
+    preview stage (JPEG encode for the live feed) through bounded queues, so a
+    slow write or encode never stalls capture.
+    """
+    def __init__(self, cap, broadcaster, preview_width=640, preview_quality=80, preview_max_fps=15.0,
+                 record_queue_size=64, on_failure=None):
+        self.cap = cap
+        self.broadcaster = broadcaster
+        self.on_failure = on_failure  # Called with the error when the camera stops delivering frames
+        self.capture_failed = False
+
+        # Live preview settings; recording always uses the full captured frame
+        self.preview_width = preview_width  # Frames wider than this are scaled down before encoding
+        self.preview_quality = preview_quality  # JPEG quality (0-100)
+        self.preview_max_fps = preview_max_fps  # Upper bound on encoded preview frames per second
+
+        # Recording must not lose frames silently, so it refuses new frames when full;
+        # the preview only ever needs the newest frame.
+        self.record_queue = StageQueue(record_queue_size, policy='drop_newest')
+        self.preview_queue = StageQueue(1, policy='drop_oldest')
+
+        self.running = False
+        self.video_file_name = None  # File currently being recorded, None when not recording
+        self.recording_lock = threading.Lock()  # Keeps the stop marker behind every frame of its recording
+        self.recording_finished = threading.Event()
+        self.recording_finished.set()
+        self.video_writer = None
+        self.timestamp_writer = None  # Sidecar with the capture time of every written frame
+        self.frame_times = deque(maxlen=30)  # Capture times used to estimate the real frame rate
+        self.threads = []
+
+        # Per-stage counters
+        self.frames_captured = 0
+        self.frames_written = 0
+        self.frames_encoded = 0
+        self.preview_frames_skipped = 0  # Rate-capped before encoding
+
+    def start(self):
+        self.running = True
+        self.threads = [threading.Thread(target=target, daemon=True)
+                        for target in (self.capture_loop, self.record_loop, self.preview_loop)]
+        for thread in self.threads:
+            thread.start()
+        print("Frame pipeline started.")
+
+    def stop(self, timeout=5):
+        self.stop_recording(timeout)
+        self.running = False
+        for thread in self.threads:
+            if thread is not threading.current_thread():  # Stopped from on_failure in the capture thread
+                thread.join(timeout=timeout)
+        print("Frame pipeline stopped.")
+
+    def start_recording(self, video_file_name):
+        self.recording_finished.clear()
+        with self.recording_lock:
+            self.video_file_name = video_file_name
+
+    def stop_recording(self, timeout=5):
+        # Queue a marker behind the pending frames and wait until the writer has drained and released
+        with self.recording_lock:
+            if self.video_file_name is None:
+                return
+            self.video_file_name = None
+            if not self.running:
+                return  # No camera, so nothing was recorded
+            self.record_queue.put((None, None, None), force=True)
+        if not self.recording_finished.wait(timeout):
+            print("Timed out waiting for the video writer to finish.")
+
+    def wait_for_frame_rate(self, timeout=3.0):
+        # A camera opened for this recording has too few capture times for a real estimate yet;
+        # its frames wait in the record queue meanwhile
+        deadline = time.monotonic() + timeout
+        while self.running and len(self.frame_times) < self.frame_times.maxlen and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def calculate_frame_rate(self):
+        if len(self.frame_times) < 2:
+            return 30.0
+        total_time = self.frame_times[-1] - self.frame_times[0]
+        average_frame_rate = (len(self.frame_times) - 1) / total_time if total_time > 0 else 30.0
+        return max(min(average_frame_rate, 30.0), 1.0)  # Ensure frame rate is at least 1.0
+
+    def stats(self):
+        return {
+            'frames_captured': self.frames_captured,
+            'frames_written': self.frames_written,
+            'frames_record_dropped': self.record_queue.dropped,
+            'frames_encoded': self.frames_encoded,
+            'frames_preview_dropped': self.preview_queue.dropped,
+            'frames_preview_skipped': self.preview_frames_skipped,
+            'record_queue_depth': len(self.record_queue),
+        }
+
+    # --- Stages ---
+
+    def capture_loop(self):
+        while self.running:
+            start = time.perf_counter()
+            success, frame = self.cap.read()
+            capture_seconds.observe(time.perf_counter() - start)
+            if not success:
+                print("Failed to capture frame.")
+                if self.running:
+                    self.capture_failed = True
+                    if self.on_failure is not None:
+                        self.on_failure("Camera stopped delivering frames")
+                break
+
+            capture_time = time.time()
+            self.frames_captured += 1
+            self.frame_times.append(capture_time)
+
+            # Read the file name and queue the frame in one step, so a frame can never land behind
+            # the stop marker of its recording and reopen (and truncate) the finished file
+            with self.recording_lock:
+                if self.video_file_name is not None:
+                    self.record_queue.put((self.video_file_name, capture_time, frame))
+            if self.broadcaster.has_viewers():
+                self.preview_queue.put((capture_time, frame))
+        print(f"Capture stopped after {self.frames_captured} frames.")
+
+    def record_loop(self):
+        writer_file_name = None
+        while self.running or len(self.record_queue):
+            item = self.record_queue.get(timeout=0.5)
+            if item is None:
+                continue
+            video_file_name, capture_time, frame = item
+
+            # The stop marker or a new file name closes the current recording
+            if video_file_name != writer_file_name or video_file_name is None:
+                self.release_writer()
+                writer_file_name = video_file_name
+                if video_file_name is None:
+                    self.recording_finished.set()
+                    continue
+                self.wait_for_frame_rate()
+                self.open_writer(video_file_name, frame)
+
+            if self.video_writer is not None:
+                try:
+                    start = time.perf_counter()
+                    self.video_writer.write(frame)
+                    video_write_seconds.observe(time.perf_counter() - start)
+                    self.timestamp_writer.append(capture_time)
+                    self.frames_written += 1
+                except Exception as e:
+                    print(f"Error writing frame: {e}")
+        self.release_writer()
+        self.recording_finished.set()
+
+    def preview_loop(self):
+        last_preview_time = 0.0
+        while self.running:
+            item = self.preview_queue.get(timeout=0.5)
+            if item is None:
+                continue
+            capture_time, frame = item
+
+            if self.preview_max_fps and capture_time - last_preview_time < 1.0 / self.preview_max_fps:
+                self.preview_frames_skipped += 1
+                continue
+            last_preview_time = capture_time
+
+            try:
+                with preview_encode_seconds.time():
+                    preview = self.encode_preview(frame)
+                if preview is None:
+                    print("Failed to encode frame to JPEG.")
+                    continue
+                self.frames_encoded += 1
+                self.broadcaster.publish(preview)
+            except Exception as e:
+                print(f"Error encoding or publishing frame: {e}")
+
+    # --- Helpers ---
+
+    # OpenCV is imported on first use, so it is never loaded while the camera is unused
+    def open_writer(self, video_file_name, frame):
+        import cv2
+        try:
+            frame_rate = self.calculate_frame_rate()
+            height, width = frame.shape[:2]
+            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+            self.video_writer = cv2.VideoWriter(video_file_name, fourcc, frame_rate, (width, height))
+            self.timestamp_writer = FrameTimestampWriter(sidecar_path(video_file_name), frame_rate)
+            print(f"Video writer initialized for recording at {frame_rate:.2f} fps")
+        except Exception as e:
+            self.video_writer = None
+            print(f"Error initializing video writer: {e}")
+
+    def release_writer(self):
+        if self.timestamp_writer is not None:
+            self.timestamp_writer.close()
+            self.timestamp_writer = None
+        if self.video_writer is not None:
+            self.video_writer.release()
+            self.video_writer = None
+            print(f"Video writer released after {self.frames_written} frames.")
+
+    def encode_preview(self, frame):
+        import cv2
+        height, width = frame.shape[:2]
+        if self.preview_width and width > self.preview_width:
+            preview_height = int(height * self.preview_width / width)
+            frame = cv2.resize(frame, (self.preview_width, preview_height), interpolation=cv2.INTER_AREA)
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.preview_quality])
+        return buffer.tobytes() if ret else None
@@ -0,0 +1,91 @@
+import os
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+
+from run_format import parse_timestamp
+
+# Sidecar layout: a 16-byte header (magic, padding, nominal fps of the video container)
+# followed by one little-endian float64 wall-clock capture time per written frame.
+HEADER = struct.Struct('<4s4xd')
+MAGIC = b'MWFT'
+RECORD_SIZE = 8
+
+
+def sidecar_path(video_file_name):
+    return os.path.splitext(video_file_name)[0] + '_frames.bin'
+
+
+class FrameTimestampWriter:
+    def __init__(self, path, frame_rate, flush_every=30):
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, frame_rate))
+        self.file.flush()  # Readers may open the sidecar before the first batch of frames is flushed
+        self.pending = array('d')
+        self.flush_every = flush_every
+
+    def append(self, capture_time):
+        self.pending.append(capture_time)
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self.pending.tofile(self.file)
+        self.pending = array('d')
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class FrameTimestampIndex:
+    """
+    Maps wall-clock timestamps (e.g. sensor log rows) to frame indices of a recorded
+    video with a binary search over the sidecar. refresh() only reads the frames
+    appended since the last call, so it also works while the video is being recorded.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.times = array('d')
+        self.frame_rate = None
+        self.offset = 0
+        self.lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        with self.lock, open(self.path, 'rb') as file:
+            if self.frame_rate is None:
+                header = file.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return  # The writer has only just created the file; no frames yet
+                magic, frame_rate = HEADER.unpack(header)
+                if magic != MAGIC:
+                    raise ValueError(f"{self.path} is not a frame timestamp file")
+                self.frame_rate = frame_rate
+                self.offset = HEADER.size
+            file.seek(self.offset)
+            data = file.read()
+            data = data[:len(data) - len(data) % RECORD_SIZE]  # Ignore a partially written record
+            self.times.frombytes(data)
+            self.offset += len(data)
+
+    def __len__(self):
+        return len(self.times)
+
+    def nearest_frame(self, timestamp):
+        # Index of the frame captured closest to `timestamp`, or None if nothing was recorded
+        if not self.times:
+            return None
+        timestamp = parse_timestamp(timestamp)
+        index = bisect_left(self.times, timestamp)
+        if index == len(self.times):
+            return index - 1
+        if index > 0 and timestamp - self.times[index - 1] <= self.times[index] - timestamp:
+            return index - 1
+        return index
+
+    def playback_position(self, frame_index):
+        # Seconds into the video at which the frame is shown by a player
+        return frame_index / self.frame_rate
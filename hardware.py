@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+
+# Hardware is acquired on first use through `registry`, never at import or construction time,
+# so the service starts fast, can be imported by tooling, and keeps running without a device.
+
+
+def simulated():
+    # MW_HARDWARE=sim swaps in the simulated devices from simulators.py
+    return os.environ.get('MW_HARDWARE', 'pi') == 'sim'
+
+
+# Backend modules, imported only when a device is first opened
+def spidev():
+    if simulated():
+        import simulators
+        return simulators
+    import spidev
+    return spidev
+
+
+def gpio():
+    if simulated():
+        import simulators
+        return simulators.GPIO
+    import RPi.GPIO
+    return RPi.GPIO
+
+
+def open_camera():
+    if simulated():
+        import simulators
+        return simulators.SimulatedCamera()
+    import cv2
+    return cv2.VideoCapture(0)
+
+
+class Device:
+    """
+    A device opened on first use by get(). Failures are recorded rather than
+    raised: while a device is unavailable get() returns None, and opening is
+    retried at most every `retry_interval` seconds, so a missing sensor
+    degrades to NaN readings instead of stopping the service.
+    """
+    def __init__(self, name, opener, closer=None, enabled=True, retry_interval=30.0):
+        self.name = name
+        self.opener = opener
+        self.closer = closer
+        self.retry_interval = retry_interval
+        self.handle = None
+        self.state = 'idle' if enabled else 'disabled'  # idle, ok, unavailable or disabled
+        self.error = None
+        self.failed_at = None
+        self.open_seconds = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        handle = self.handle
+        if handle is not None or self.state == 'disabled':
+            return handle
+        with self.lock:
+            if self.handle is not None:
+                return self.handle
+            if self.failed_at is not None and time.monotonic() - self.failed_at < self.retry_interval:
+                return None
+            start = time.perf_counter()
+            try:
+                self.handle = self.opener()
+            except Exception as e:
+                self.mark_unavailable(e)
+                return None
+            self.open_seconds = time.perf_counter() - start
+            self.state, self.error, self.failed_at = 'ok', None, None
+            print(f"{self.name} opened in {self.open_seconds:.3f} s.")
+            return self.handle
+
+    def mark_unavailable(self, error):
+        self.state = 'unavailable'
+        self.error = str(error)
+        self.failed_at = time.monotonic()
+        print(f"{self.name} unavailable: {error}")
+
+    def fail(self, error):
+        # Called when an opened device stops answering; it is closed and reopened after retry_interval
+        with self.lock:
+            handle, self.handle = self.handle, None
+            self.mark_unavailable(error)
+        self.close_handle(handle)
+
+    def close(self):
+        with self.lock:
+            handle, self.handle = self.handle, None
+            if self.state == 'ok':
+                self.state = 'idle'
+        self.close_handle(handle)
+
+    def close_handle(self, handle):
+        if handle is None or self.closer is None:
+            return
+        try:
+            self.closer(handle)
+        except Exception as e:
+            print(f"Error while closing {self.name}: {e}")
+
+    def status(self):
+        return {'state': self.state, 'error': self.error, 'open_seconds': self.open_seconds}
+
+
+class HardwareRegistry:
+    def __init__(self):
+        self.devices = {}
+
+    def register(self, name, opener, closer=None, enabled=True, retry_interval=30.0):
+        # Registering a name again replaces the device (closing the old one)
+        old = self.devices.get(name)
+        self.devices[name] = Device(name, opener, closer, enabled, retry_interval)
+        if old is not None:
+            old.close()
+
+    def get(self, name):
+        # The opened device, or None if it is unknown, disabled or unavailable
+        device = self.devices.get(name)
+        return device.get() if device is not None else None
+
+    def fail(self, name, error):
+        self.devices[name].fail(error)
+
+    def status(self):
+        return {name: device.status() for name, device in self.devices.items()}
+
+    def close_all(self):
+        # In reverse order of registration, so devices close before what they depend on
+        for device in reversed(list(self.devices.values())):
+            device.close()
+
+
+registry = HardwareRegistry()
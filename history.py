@@ -0,0 +1,107 @@
+import math
+import threading
+from bisect import bisect_left, bisect_right
+
+
+class HistoryLevel:
+    """
+    Fixed-width time buckets holding per-channel [min, max, sum, count].
+    A width of 0 stores every raw sample in its own bucket; that level can be
+    bounded, in which case the oldest buckets are trimmed in batches.
+    """
+    def __init__(self, width, max_buckets=None):
+        self.width = width
+        self.max_buckets = max_buckets
+        self.trimmed = False
+        self.starts = []
+        self.buckets = []
+
+    def add(self, time_s, values):
+        start = time_s - time_s % self.width if self.width else time_s
+        if self.starts and self.starts[-1] == start:
+            for stats, value in zip(self.buckets[-1], values):
+                if not math.isnan(value):
+                    stats[0] = min(stats[0], value)
+                    stats[1] = max(stats[1], value)
+                    stats[2] += value
+                    stats[3] += 1
+            return
+
+        self.starts.append(start)
+        self.buckets.append([[value, value, value, 1] if not math.isnan(value) else [math.inf, -math.inf, 0.0, 0]
+                             for value in values])
+        # Trim a quarter of the bound at a time so trimming stays amortized O(1) per sample
+        if self.max_buckets and len(self.starts) > self.max_buckets + self.max_buckets // 4:
+            excess = len(self.starts) - self.max_buckets
+            del self.starts[:excess]
+            del self.buckets[:excess]
+            self.trimmed = True
+
+    def covers(self, start):
+        return bool(self.starts) and (not self.trimmed or self.starts[0] <= start)
+
+    def span(self, start, end):
+        # Index range of the buckets overlapping [start, end]
+        lo = bisect_right(self.starts, start - self.width) if self.width else bisect_left(self.starts, start)
+        return lo, bisect_right(self.starts, end)
+
+
+class MultiResolutionHistory:
+    """
+    Whole-run history kept at several resolutions and maintained as samples
+    arrive: the raw samples (bounded) plus min/max/mean buckets at each width
+    in `widths` seconds. A query answers from the finest level that fits the
+    requested point count, so its cost follows the number of points returned,
+    not the length of the run.
+    """
+    def __init__(self, channels, widths=(10, 60, 600), max_raw_samples=20000):
+        self.channels = channels
+        self.widths = widths
+        self.max_raw_samples = max_raw_samples
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.levels = [HistoryLevel(0, self.max_raw_samples)] + [HistoryLevel(width) for width in self.widths]
+
+    def add(self, time_s, values):
+        with self.lock:
+            for level in self.levels:
+                level.add(time_s, values)
+
+    def query(self, start=None, end=None, points=500):
+        with self.lock:
+            coarsest = self.levels[-1]
+            if not coarsest.starts:
+                return {'level': 0, 'time': [], 'channels': {}}
+            start = coarsest.starts[0] if start is None else start
+            end = math.inf if end is None else end
+
+            for level in self.levels:
+                if not level.covers(start):
+                    continue
+                lo, hi = level.span(start, end)
+                if hi - lo <= points:
+                    break
+            # If even the coarsest level is too dense, merge neighbouring buckets on the fly
+            group = max(math.ceil((hi - lo) / points), 1) if points > 0 else 1
+            starts = level.starts[lo:hi]
+            buckets = [[list(stats) for stats in bucket] for bucket in level.buckets[lo:hi]]
+
+        times = []
+        series = [{'min': [], 'max': [], 'mean': []} for _ in range(len(self.channels))]
+        for i in range(0, len(buckets), group):
+            times.append(starts[i])
+            merged = buckets[i:i + group]
+            for channel, out in enumerate(series):
+                stats = [bucket[channel] for bucket in merged]
+                count = sum(s[3] for s in stats)
+                out['min'].append(min(s[0] for s in stats) if count else None)
+                out['max'].append(max(s[1] for s in stats) if count else None)
+                out['mean'].append(round(sum(s[2] for s in stats) / count, 2) if count else None)
+        return {
+            'level': level.width * group,
+            'time': times,
+            'channels': dict(zip(self.channels, series)),
+        }
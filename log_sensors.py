@@ -1,136 +1,310 @@
 import time
 import csv
-from datetime import datetime
-import spidev
-import math
-import RPi.GPIO as GPIO
+import json
+import logging
+import os
+import threading
+from contextlib import nullcontext
+import hardware
+import metrics
+from channel_stats import ChannelMonitor
+from history import MultiResolutionHistory
+from run_index import SparseIndexWriter
+from run_format import RunWriter, csv_header, format_timestamp, run_path
+from scheduler import PeriodicScheduler
+from sample_buffer import SampleBuffer, SampleHub, format_sample
+from thermistor import codes_to_temperature
 
-# Setup GPIO mode
-GPIO.setmode(GPIO.BCM)
+sweep_seconds = metrics.Histogram('mw_spi_sweep_seconds', "Time to read every sensor in one SPI sweep")
+log_write_seconds = metrics.Histogram('mw_log_write_seconds', "Time to write and flush one sample", ['file'])
+sample_jitter_seconds = metrics.Histogram('mw_sample_jitter_seconds', "Lateness of each sample against its deadline")
+samples_total = metrics.Counter('mw_samples_total', "Samples logged")
+alarms_total = metrics.Counter('mw_alarms_total', "Alarms raised", ['channel', 'kind'])
+
+# One structured log line per interval instead of a print per sample
+sample_log = metrics.RateLimitedLog(logging.getLogger('log_sensors'), interval=10.0)
 
 # --- MAX6675 Class ---
 class MAX6675:
-    def __init__(self, cs_pin):
+    CONVERSION_TIME = 0.22  # Seconds the MAX6675 needs to finish a conversion
+
+    def __init__(self, cs_pin, gpio):
         self.cs_pin = cs_pin
-        GPIO.setup(self.cs_pin, GPIO.OUT)
-        GPIO.output(self.cs_pin, GPIO.HIGH)
+        self.gpio = gpio
+        gpio.setup(self.cs_pin, gpio.OUT)
+        gpio.output(self.cs_pin, gpio.HIGH)
 
-    def read_temp(self):
-        GPIO.output(self.cs_pin, GPIO.LOW)
-        time.sleep(0.01)
+        # Keep one SPI handle open for the lifetime of the sensor instead of reopening it per read
+        self.spi = hardware.spidev().SpiDev()
+        self.spi.open(0, 1)  # Use SPI0.1 for MAX6675
+        self.spi.max_speed_hz = 500000
 
-        # Open the SPI bus for MAX6675
-        spi = spidev.SpiDev()
-        spi.open(0, 1)  # Use SPI0.1 for MAX6675
-        spi.max_speed_hz = 500000
+        self.last_read_time = None
+        self.last_temp = float('NaN')
+
+    def read_temp(self):
+        # Pulling CS low aborts the running conversion, so never read faster than the
+        # chip converts; return the previous reading instead
+        now = time.monotonic()
+        if self.last_read_time is not None and now - self.last_read_time < self.CONVERSION_TIME:
+            return self.last_temp
 
         # Read two bytes of data from MAX6675
-        value = spi.xfer2([0x00, 0x00])
-        GPIO.output(self.cs_pin, GPIO.HIGH)
-        spi.close()  # Close SPI after use
+        self.gpio.output(self.cs_pin, self.gpio.LOW)
+        value = self.spi.xfer2([0x00, 0x00])
+        self.gpio.output(self.cs_pin, self.gpio.HIGH)
+        self.last_read_time = now
 
         # Process raw temperature value
-        raw_value = ((value[0] << 8) | value[1]) >> 3
-        temp_c = raw_value * 0.25
-        return round(temp_c, 2)  # Return temperature with 2 decimal places
+        raw = (value[0] << 8) | value[1]
+        if raw & 0x4:  # D2 is set when the thermocouple input is open
+            self.last_temp = float('NaN')
+        else:
+            self.last_temp = round((raw >> 3) * 0.25, 2)  # Temperature with 2 decimal places
+        return self.last_temp
+
+    def close(self):
+        self.spi.close()
 
-# Setup SPI for MCP3008 (SPI0.0)
-spi = spidev.SpiDev()
-spi.open(0, 0)  # Use SPI0.0 for MCP3008
-spi.max_speed_hz = 1000000
+# --- Devices ---
+# Opened on first use through the hardware registry; nothing is touched at import time
+
+def open_gpio():
+    gpio = hardware.gpio()
+    gpio.setmode(gpio.BCM)
+    return gpio
+
+def open_mcp3008():
+    spi = hardware.spidev().SpiDev()
+    spi.open(0, 0)  # Use SPI0.0 for MCP3008
+    spi.max_speed_hz = 1000000
+    return spi
+
+def open_max6675():
+    gpio = hardware.registry.get('gpio')
+    if gpio is None:
+        raise RuntimeError("GPIO is unavailable")
+    return MAX6675(cs_pin=7, gpio=gpio)  # MAX6675 on GPIO 7 (CS pin)
+
+hardware.registry.register('gpio', open_gpio, lambda gpio: gpio.cleanup())
+hardware.registry.register('mcp3008', open_mcp3008, lambda spi: spi.close())
+hardware.registry.register('max6675', open_max6675, lambda max6675: max6675.close())
 
 # Number of thermistors to read
 no_of_thermistors = 8  # Adjust this value based on how many thermistors you want to log
 
-# Function to read MCP3008 (single channel)
-def read_adc(adcnum):
-    if (adcnum > 7) or (adcnum < 0):
-        return -1
-    r = spi.xfer2([1, (8 + adcnum) << 4, 0])
-    adcout = ((r[1] & 3) << 8) + r[2]
-    voltage = (adcout * 3.3) / 1024.0  # Convert raw ADC value to voltage (assuming 3.3V reference)
-    return voltage
+# --- Acquisition engine ---
+class AcquisitionEngine:
+    """
+    Reads every MCP3008 channel and the MAX6675 in one burst over the persistent
+    SPI handles. Each channel can be oversampled: its raw codes are read
+    `oversample` times back to back and averaged. The duration of every sweep is
+    recorded so the sample rate can be raised without guessing.
+    """
+    def __init__(self, channels=no_of_thermistors, oversample=1, thermocouple=None):
+        self.channels = list(range(channels))
+        self.oversample = oversample  # Reads per channel: an int for all channels or a {channel: reads} dict
+        self.thermocouple = thermocouple  # Defaults to the registry's MAX6675
 
-# Function to convert voltage to temperature for thermistors
-def voltage_to_temperature(voltage):
-    if voltage <= 0:  # Check if voltage is valid
-        return float('NaN')  # Return NaN to avoid division by zero
+        # Pre-built MCP3008 command frames so the burst does no per-read work
+        self.commands = {channel: [1, (8 + channel) << 4, 0] for channel in self.channels}
 
-    R_fixed = 10000  # 10k fixed resistor
-    V_ref = 3.3  # Reference voltage for the ADC
+        self.sweeps = 0
+        self.last_sweep_latency = 0.0
+        self.max_sweep_latency = 0.0
+        self.total_sweep_latency = 0.0
 
-    try:
-        # Calculate the resistance of the thermistor
-        R_thermistor = R_fixed * (V_ref / voltage - 1)
-        lnohm = math.log(R_thermistor)
-    except ValueError:
-        return float('NaN')  # Return NaN if log fails (negative ohms)
+    def reads_for(self, channel):
+        if isinstance(self.oversample, dict):
+            return max(self.oversample.get(channel, 1), 1)
+        return max(self.oversample, 1)
 
-    # Steinhart-Hart coefficients for 10k thermistor
-    # a = 1.123760013e-3 # From datasheet for 10k thermistor
-    # b = 2.330409748e-4 # From datasheet for 10k thermistor
-    # c = 1.073440972e-7 # From datasheet for 10k thermistor
+    def read_codes(self):
+        # NaN codes (and so NaN temperatures) while the MCP3008 is unavailable
+        spi = hardware.registry.get('mcp3008')
+        if spi is None:
+            return [float('NaN')] * len(self.channels)
 
-    a = -0.3080782548e-3 # From calibration for 10k thermistor
-    b = 4.895032621e-4 # From calibration for 10k thermistor
-    c = -10.75680830e-7 # From calibration for 10k thermistor
+        # The MCP3008 needs CS released between conversions, so each read is its own transfer
+        xfer2 = spi.xfer2
+        codes = []
+        try:
+            for channel in self.channels:
+                command = self.commands[channel]
+                reads = self.reads_for(channel)
+                total = 0
+                for _ in range(reads):
+                    r = xfer2(command)
+                    total += ((r[1] & 3) << 8) + r[2]
+                codes.append(total / reads if reads > 1 else total)
+        except OSError as e:
+            hardware.registry.fail('mcp3008', e)
+            return [float('NaN')] * len(self.channels)
+        return codes
 
-    t1 = b * lnohm
-    t2 = c * lnohm**3
-    temp_k = 1 / (a + t1 + t2)  # Temperature in Kelvin
-    temp_c = temp_k - 273.15  # Convert Kelvin to Celsius
+    def read_thermocouple(self):
+        thermocouple = self.thermocouple or hardware.registry.get('max6675')
+        if thermocouple is None:
+            return float('NaN')
+        try:
+            return thermocouple.read_temp()
+        except OSError as e:
+            if self.thermocouple is None:
+                hardware.registry.fail('max6675', e)
+            return float('NaN')
 
-    return round(temp_c, 2)  # Return temperature with 2 decimal places
+    def sweep(self):
+        # Returns (raw thermistor ADC codes, thermocouple temperature)
+        start = time.perf_counter()
+        codes = self.read_codes()
+        thermocouple_temp = self.read_thermocouple()
+        latency = time.perf_counter() - start
 
-# Initialize MAX6675 on GPIO 7 (CS pin)
-max6675 = MAX6675(cs_pin=7)
+        self.sweeps += 1
+        self.last_sweep_latency = latency
+        self.max_sweep_latency = max(self.max_sweep_latency, latency)
+        self.total_sweep_latency += latency
+        sweep_seconds.observe(latency)
+        return codes, thermocouple_temp
+
+    def stats(self):
+        return {
+            'sweeps': self.sweeps,
+            'last_sweep_latency': self.last_sweep_latency,
+            'max_sweep_latency': self.max_sweep_latency,
+            'mean_sweep_latency': self.total_sweep_latency / self.sweeps if self.sweeps else 0.0,
+        }
+
+engine = AcquisitionEngine()
 
 logging_active = False  # A flag to control the logging loop
+# The compact binary run file is the log; MW_CSV_LOG=1 also writes the CSV (and its index) as samples arrive.
+# Downloads are CSV either way, converted from the run file on the fly.
+csv_log_enabled = os.environ.get('MW_CSV_LOG') == '1'
+
+# Recent samples kept in memory so the web server never has to re-read the CSV
+sample_buffer = SampleBuffer()
+# Pushes every new sample to the clients subscribed to the live stream
+sample_hub = SampleHub()
+
+# Whole-run min/max/mean history at several resolutions for the run plots
+history = MultiResolutionHistory(csv_header(no_of_thermistors)[1:-1])
+
+# Running per-channel statistics and alarms of the current run, served by /status.
+# Alarms are configured with MW_ALARMS, a JSON list such as
+# [{"channel": "Thermocouple", "kind": "rate_above", "limit": 5}], or through /alarms.
+channel_monitor = ChannelMonitor(csv_header(no_of_thermistors)[1:-1])
+channel_monitor.set_alarms(json.loads(os.environ.get('MW_ALARMS', '[]')))
+alarm_log = logging.getLogger('log_sensors.alarms')
 
-# Log data function
-def log_data(log_file):
-    with open(log_file, mode='a', newline='') as file:
-        writer = csv.writer(file)
+# Publish a sample to the in-memory buffer, every live stream subscriber, the run history and the channel monitor
+def publish_sample(timestamp, readings, time_ns=None):
+    row = format_sample(timestamp, readings)
+    seq = sample_buffer.append(row)
+    sample_hub.publish(seq, sample_buffer.run_start_seq, row)
+    time_s = (time_ns if time_ns is not None else time.time_ns()) / 1e9
+    history.add(time_s, readings)
+    for alarm in channel_monitor.add(time_s, readings):
+        if alarm['active']:
+            alarms_total.labels(alarm['channel'], alarm['kind']).inc()
+            alarm_log.warning("alarm raised channel=%s kind=%s limit=%g value=%g time=%s",
+                              alarm['channel'], alarm['kind'], alarm['limit'], alarm['value'], timestamp)
+        else:
+            alarm_log.info("alarm cleared channel=%s kind=%s limit=%g value=%g time=%s",
+                           alarm['channel'], alarm['kind'], alarm['limit'], alarm['value'], timestamp)
+    return seq
 
-        if file.tell() == 0:  # Write header if file is empty
-            header = ['Timestamp'] + [f'Thermistor{i+1}' for i in range(no_of_thermistors)] + ['Thermocouple', 'Comment']
-            writer.writerow(header)
+# Log data function; blocks, taking one sample per scheduler tick until the scheduler is stopped.
+# Every sample goes to the compact binary run file (raw codes, nanosecond timestamps);
+# the human-readable CSV is only written alongside it when csv_log_enabled is set.
+def log_data(log_file, scheduler, run_writer):
+    with open(log_file, mode='a', newline='') if csv_log_enabled else nullcontext() as file:
+        writer = csv.writer(file) if file is not None else None
+        index_writer = SparseIndexWriter(log_file) if file is not None else None
+        run_write_seconds = log_write_seconds.labels('run')
+        csv_write_seconds = log_write_seconds.labels('csv')
 
-        while logging_active:
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if writer is not None and file.tell() == 0:  # Write header if file is empty
+            writer.writerow(csv_header(no_of_thermistors))
 
-            # Read and convert thermistor voltages
-            thermistor_readings = [voltage_to_temperature(read_adc(i)) for i in range(no_of_thermistors)]
+        def sample():
+            time_ns = time.time_ns()
+            timestamp = format_timestamp(time_ns, scheduler.period)
 
-            # Reading temperature from MAX6675
-            thermocouple_temp = max6675.read_temp()
+            # Read every sensor in one burst, then convert the thermistor codes in one go
+            codes, thermocouple_temp = engine.sweep()
+            thermistor_readings = codes_to_temperature(codes).tolist()
 
             # Log the data
-            writer.writerow([timestamp] + thermistor_readings + [thermocouple_temp, ''])  # Empty comment field
+            start = time.perf_counter()
+            run_writer.append(time_ns, codes, thermocouple_temp)
+            run_write_seconds.observe(time.perf_counter() - start)
+            if writer is not None:
+                start = time.perf_counter()
+                index_writer.add(time_ns / 1e9, file.tell())
+                writer.writerow([timestamp] + thermistor_readings + [thermocouple_temp, ''])  # Empty comment field
+                file.flush()
+                csv_write_seconds.observe(time.perf_counter() - start)
 
-            # Print debug information
-            thermistor_info = " | ".join([f"Thermistor{i+1}: {thermistor_readings[i]:.2f} °C" for i in range(no_of_thermistors)])
-            print(f"{timestamp} | {thermistor_info} | Thermocouple: {thermocouple_temp:.2f} °C")
+            # Publish the pre-rounded sample for the live view
+            publish_sample(timestamp, thermistor_readings + [thermocouple_temp], time_ns)
 
-            file.flush()
-            time.sleep(2) #Change this to change how often the sensors are read
+            samples_total.inc()
+            sample_jitter_seconds.observe(scheduler.last_jitter)
+            sample_log.info('sample', timestamp=timestamp, thermistors=thermistor_readings,
+                            thermocouple=thermocouple_temp)
 
-# Start logging
-def start_logging(log_file):
-    global logging_active
+        try:
+            scheduler.run(sample)
+        finally:
+            run_writer.close()
+            if index_writer is not None:
+                index_writer.close()
+
+scheduler = None  # Drives log_data on deadlines while logging is active
+logging_thread = None
+run_start_record = 0  # Index of the current run's first record in its run file
+
+# Start logging on a background thread; returns immediately
+def start_logging(log_file, sample_period=2.0):
+    global logging_active, scheduler, logging_thread, run_start_record
+    if logging_active:
+        stop_logging()
+    # Both raise ValueError for settings that can't be logged, before any state has changed.
+    # The writer is opened here rather than on the logging thread, so run_start_record is set before this returns.
+    new_scheduler = PeriodicScheduler(sample_period)
+    run_writer = RunWriter(run_path(log_file), no_of_thermistors, sample_period)
+    run_start_record = run_writer.first_record
+    scheduler = new_scheduler
     logging_active = True
-    log_data(log_file)
+    sample_buffer.clear()
+    history.clear()
+    channel_monitor.clear()
+    logging_thread = threading.Thread(target=log_data, args=(log_file, scheduler, run_writer), daemon=True)
+    logging_thread.start()
 
-# Stop logging
+# Stop logging; waits at most for the sample in progress
 def stop_logging():
     global logging_active
     logging_active = False
+    if scheduler is not None:
+        scheduler.stop()
+    if logging_thread is not None:
+        logging_thread.join(timeout=5)
     print("Logging Sensors stopped.")
 
+def stats():
+    # Acquisition and scheduling statistics of the current (or last) run
+    if scheduler is None:
+        return engine.stats()
+    return {**engine.stats(), **scheduler.stats()}
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
     try:
         start_logging("temperature_log.csv")
+        while True:
+            time.sleep(1)
     except KeyboardInterrupt:
         stop_logging()
-        spi.close()  # Close SPI before exiting
-        GPIO.cleanup()  # Clean up GPIO pins properly
\ No newline at end of file
+        hardware.registry.close_all()  # Close SPI and clean up GPIO pins properly
@@ -0,0 +1,281 @@
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as StackCounter
+
+# Low-overhead instrumentation: counters, gauges and latency histograms rendered in the
+# Prometheus text format, a sampling profiler, and rate-limited structured logging.
+# Metrics register themselves in `registry` when created; /metrics renders it.
+registry = {}
+registry_lock = threading.Lock()
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0)
+
+
+class Metric:
+    """
+    Base of the metric types. A metric with `labelnames` holds one child per
+    combination of label values, obtained with labels(); one without labels is
+    its own single child.
+    """
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+        with registry_lock:
+            registry[name] = self
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def unlabelled(self):
+        return self.labels()
+
+    def label_text(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for values, child in sorted(self.children.items()):
+            lines.extend(self.render_child(values, child))
+        return lines
+
+
+class CounterValue:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def new_child(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        self.unlabelled().inc(amount)
+
+    def render_child(self, values, child):
+        return [f'{self.name}{self.label_text(values)} {format_value(child.value)}']
+
+
+class Gauge(Metric):
+    """A value that is set, or read from `function` whenever the metrics are rendered."""
+    type = 'gauge'
+
+    def __init__(self, name, help, function=None):
+        super().__init__(name, help)
+        self.value = 0.0
+        self.function = function
+
+    def set(self, value):
+        self.value = value
+
+    def render(self):
+        try:
+            value = self.function() if self.function is not None else self.value
+        except Exception:
+            value = float('NaN')
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}', f'{self.name} {format_value(value)}']
+
+
+class HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return Timer(self)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labelnames)
+
+    def new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.unlabelled().observe(value)
+
+    def time(self):
+        return Timer(self.unlabelled())
+
+    def render_child(self, values, child):
+        with child.lock:
+            counts, total = list(child.counts), child.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else f'{bound:g}'
+            lines.append(f'{self.name}_bucket{self.label_text(values, [("le", le)])} {cumulative}')
+        lines.append(f'{self.name}_sum{self.label_text(values)} {format_value(total)}')
+        lines.append(f'{self.name}_count{self.label_text(values)} {cumulative}')
+        return lines
+
+
+class Timer:
+    # `with histogram.time():` observes the duration of the block
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+def format_value(value):
+    # Full float precision, so large counters still move by one; NaN and infinities spelled as Prometheus expects
+    value = float(value)
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render():
+    # Every registered metric in the Prometheus text exposition format
+    with registry_lock:
+        metrics = list(registry.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    """
+    In-process sampling profiler: while running, a thread snapshots the stack of
+    every other thread each `interval` seconds and counts identical stacks.
+    report() returns them in the folded format used by flame graph tools.
+    Costs nothing while stopped.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = StackCounter()
+        self.samples = 0
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.sample_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+        self.thread = None
+
+    def reset(self):
+        with self.lock:
+            self.stacks.clear()
+            self.samples = 0
+
+    def sample_loop(self):
+        own_thread = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_filename.rsplit("/", 1)[-1]}:{code.co_name}')
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks.append(';'.join(reversed(stack)))
+            with self.lock:
+                self.stacks.update(stacks)
+                self.samples += 1
+
+    def report(self, limit=None):
+        with self.lock:
+            stacks = self.stacks.most_common(limit)
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks)
+
+
+class RateLimitedLog:
+    """
+    Structured (key=value) logging of at most one message per `interval`
+    seconds. Messages in between are only counted, and the count is reported
+    with the next one, so a hot loop can log every iteration almost for free.
+    """
+    def __init__(self, logger, interval=10.0):
+        self.logger = logger
+        self.interval = interval
+        self.next_time = 0.0
+        self.suppressed = 0
+
+    def log(self, level, event, **fields):
+        now = time.monotonic()
+        if now < self.next_time:
+            self.suppressed += 1
+            return
+        self.next_time = now + self.interval
+        if self.suppressed:
+            fields['suppressed'] = self.suppressed
+            self.suppressed = 0
+        self.logger.log(level, '%s %s', event, ' '.join(f'{key}={format_field(value)}' for key, value in fields.items()))
+
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, **fields)
+
+
+def format_field(value):
+    if isinstance(value, float):
+        return f'{value:.2f}'
+    if isinstance(value, (list, tuple)):
+        return ','.join(format_field(item) for item in value)
+    return str(value)
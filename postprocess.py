@@ -0,0 +1,377 @@
+"""
+Offline post-processing of finished runs: renders each run's video with a
+temperature and comment overlay and writes a summary of the run (peak
+temperatures, time above thresholds, heating rates).
+
+Runs are found as `{power}_{catalyst}_{duration}_video.mp4` and
+`{power}_{catalyst}_{duration}_sensor_log.csv` pairs. Videos are split into
+segments that are rendered in parallel across a process pool, and the sensor
+log is streamed, never loaded whole:
+
+    python postprocess.py . --workers 4 --threshold 100 --threshold 300
+"""
+import argparse
+import csv
+import glob
+import json
+import math
+import os
+import re
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from channel_stats import ChannelStats
+from frame_timestamps import FrameTimestampIndex, sidecar_path
+from run_catalog import active_files
+from run_format import parse_timestamp, run_path
+from run_index import read_range
+
+RUN_NAME = re.compile(r'^(?P<power>[^_]+)_(?P<catalyst>.+)_(?P<duration>\d+m_\d+s)$')
+COMMENT_HOLD = 10.0  # Seconds a comment stays on screen after its row
+
+
+def find_runs(paths, include_active=False):
+    """
+    Return the runs under `paths` (directories or video files) that have both a
+    video and a sensor log, as dicts of their file names and parameters. Runs the
+    catalog still lists as active are skipped unless `include_active` is set.
+    """
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            videos.extend(sorted(glob.glob(os.path.join(path, '*_video.mp4'))))
+        else:
+            videos.append(path)
+
+    runs = []
+    for video in videos:
+        directory = os.path.dirname(os.path.abspath(video))
+        prefix = os.path.basename(video)[:-len('_video.mp4')]
+        log = os.path.join(directory, f'{prefix}_sensor_log.csv')
+        if not (os.path.exists(log) or os.path.exists(run_path(log))):
+            print(f"Skipping {video}: no sensor log.")
+            continue
+        if not include_active and os.path.abspath(video) in active_files(os.path.join(directory, 'runs.db')):
+            print(f"Skipping {video}: run is still active.")
+            continue
+        match = RUN_NAME.match(prefix)
+        runs.append({'name': prefix, 'video': os.path.abspath(video), 'log': log,
+                     **(match.groupdict() if match else {'power': None, 'catalyst': None, 'duration': None})})
+    return runs
+
+
+def parse_row(row):
+    # (epoch seconds, readings, comment) of a sensor log row; the readings end with the thermocouple
+    readings = [to_float(value) for value in row[1:-1]]
+    return parse_timestamp(row[0]), readings, row[-1]
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+# --- Frame timing ---
+
+def frame_times(video, frame_count, fps, log):
+    """
+    Wall-clock capture time of every frame: from the frame timestamp sidecar
+    when the run has one, otherwise spread evenly from the first log row.
+    """
+    if os.path.exists(sidecar_path(video)):
+        times = list(FrameTimestampIndex(sidecar_path(video)).times)
+        if len(times) >= frame_count:
+            return times[:frame_count]
+    rows = read_range(log)
+    next(rows)  # Header
+    first = next(rows, None)
+    start = parse_timestamp(first[0]) if first else 0.0
+    return [start + i / fps for i in range(frame_count)]
+
+
+# --- Overlay rendering ---
+
+def draw_overlay(frame, cv2, header, time_s, readings, comment):
+    height, width = frame.shape[:2]
+    scale = max(width / 1280, 0.4)
+    line_height = int(28 * scale) + 4
+    names = [name.replace('Thermistor', 'T').replace('Thermocouple', 'TC') for name in header[1:-1]]
+    values = [f"{name} {value:6.1f}" if not math.isnan(value) else f"{name}    --" for name, value in zip(names, readings)]
+    lines = [time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time_s)) + f".{int(time_s % 1 * 10)}",
+             "  ".join(values[:4]), "  ".join(values[4:8]), "  ".join(values[8:]) + " C"]
+    if comment:
+        lines.append(comment[:80])
+
+    # Darken the box behind the text instead of blending a second image
+    box = frame[:line_height * len(lines) + 8, :width]
+    box[:] = box // 3
+    for i, line in enumerate(lines):
+        cv2.putText(frame, line, (8, line_height * (i + 1)), cv2.FONT_HERSHEY_SIMPLEX, 0.7 * scale,
+                    (0, 255, 255) if i == 4 else (255, 255, 255), max(int(2 * scale), 1), cv2.LINE_AA)
+
+
+def render_segment(video, log, output, start_frame, stop_frame, times):
+    """
+    Render frames [start_frame, stop_frame) of `video` with the overlay into
+    `output`. `times` are the capture times of those frames. Only the log rows
+    of the segment's time range are read. Runs in a worker process.
+    """
+    import cv2
+    cv2.setNumThreads(1)  # The pool already uses every core
+
+    capture = cv2.VideoCapture(video)
+    capture.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    writer = None
+
+    # Start a little early so the first frames have a row to show, and a comment still on screen
+    rows = read_range(log, times[0] - COMMENT_HOLD, times[-1])
+    header = next(rows)
+    current = upcoming = None
+    comment, comment_time = '', None
+    written = 0
+    for time_s in times:
+        success, frame = capture.read()
+        if not success:
+            break
+        # Advance to the last row logged at or before this frame
+        while True:
+            if upcoming is None:
+                row = next(rows, None)
+                if row is None:
+                    break
+                upcoming = parse_row(row)
+            if upcoming[0] > time_s:
+                break
+            current, upcoming = upcoming, None
+            if current[2]:
+                comment, comment_time = current[2], current[0]
+        if comment_time is not None and time_s - comment_time > COMMENT_HOLD:
+            comment = ''
+
+        if writer is None:
+            height, width = frame.shape[:2]
+            writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+        if current is not None:
+            draw_overlay(frame, cv2, header, time_s, current[1], comment)
+        writer.write(frame)
+        written += 1
+
+    capture.release()
+    if writer is not None:
+        writer.release()
+    return output, written
+
+
+def concatenate(parts, output):
+    # Join the rendered segments; stream copy with ffmpeg when it is installed, re-encode with OpenCV otherwise
+    parts = [part for part in parts if os.path.exists(part)]
+    if shutil.which('ffmpeg'):
+        list_file = output + '.parts.txt'
+        with open(list_file, 'w') as file:
+            file.writelines(f"file '{os.path.abspath(part)}'\n" for part in parts)
+        try:
+            subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_file,
+                            '-c', 'copy', output], check=True)
+        finally:
+            os.remove(list_file)
+    else:
+        import cv2
+        writer = None
+        for part in parts:
+            capture = cv2.VideoCapture(part)
+            while True:
+                success, frame = capture.read()
+                if not success:
+                    break
+                if writer is None:
+                    height, width = frame.shape[:2]
+                    writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*'mp4v'),
+                                             capture.get(cv2.CAP_PROP_FPS) or 30.0, (width, height))
+                writer.write(frame)
+            capture.release()
+        if writer is not None:
+            writer.release()
+    for part in parts:
+        os.remove(part)
+
+
+# --- Summaries ---
+
+def summarize(run, thresholds):
+    """
+    One streaming pass over the run's sensor log. Per channel: peak (and when),
+    minimum, seconds at or above each threshold, the steepest smoothed heating
+    rate, the mean heating rate from the start to the peak, and NaN readings.
+    """
+    rows = read_range(run['log'])
+    header = next(rows)
+    names = header[1:-1]
+    channels = {name: {'peak': -math.inf, 'peak_time': None, 'min': math.inf, 'first': None, 'first_time': None,
+                       'above': {threshold: 0.0 for threshold in thresholds}, 'max_heating_rate': -math.inf,
+                       'rates': ChannelStats()}
+                for name in names}
+    samples, comments = 0, []
+    start = end = None
+    previous = None
+
+    for row in rows:
+        time_s, readings, comment = parse_row(row)
+        samples += 1
+        start = time_s if start is None else start
+        end = time_s
+        if comment:
+            comments.append({'time': row[0], 'comment': comment})
+
+        # Each reading holds until the next sample
+        if previous is not None:
+            dt = time_s - previous[0]
+            for name, value in zip(names, previous[1]):
+                for threshold in thresholds:
+                    if value >= threshold:
+                        channels[name]['above'][threshold] += dt
+
+        for name, value in zip(names, readings):
+            channel = channels[name]
+            channel['rates'].add(time_s, value)
+            if math.isnan(value):
+                continue
+            if channel['first'] is None:
+                channel['first'], channel['first_time'] = value, time_s
+            if value > channel['peak']:
+                channel['peak'], channel['peak_time'] = value, time_s
+            channel['min'] = min(channel['min'], value)
+            if channel['rates'].last_time != channel['first_time']:
+                channel['max_heating_rate'] = max(channel['max_heating_rate'], channel['rates'].rate)
+        previous = (time_s, readings)
+
+    summary = {key: run[key] for key in ('name', 'power', 'catalyst', 'duration', 'video', 'log')}
+    summary.update({
+        'start': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start)) if start is not None else None,
+        'duration_seconds': end - start if start is not None else 0.0,
+        'samples': samples,
+        'comments': comments,
+        'channels': {},
+    })
+    for name, channel in channels.items():
+        found = channel['peak_time'] is not None
+        to_peak = channel['peak_time'] - channel['first_time'] if found else 0.0
+        summary['channels'][name] = {
+            'peak': channel['peak'] if found else None,
+            'peak_time': time.strftime('%H:%M:%S', time.localtime(channel['peak_time'])) if found else None,
+            'min': channel['min'] if found else None,
+            'seconds_above': {f'{threshold:g}': round(seconds, 1) for threshold, seconds in channel['above'].items()},
+            'max_heating_rate': round(channel['max_heating_rate'], 3) if math.isfinite(channel['max_heating_rate'])
+            else None,
+            'mean_heating_rate_to_peak': round((channel['peak'] - channel['first']) / to_peak, 3) if to_peak > 0
+            else None,
+            'nan_readings': channel['rates'].nan_count,
+        }
+    return summary
+
+
+def write_summaries(summaries, output_dir, thresholds):
+    for summary in summaries:
+        with open(os.path.join(output_dir, f"{summary['name']}_summary.json"), 'w') as file:
+            json.dump(summary, file, indent=2)
+
+    # One row per run and channel across the whole batch
+    with open(os.path.join(output_dir, 'summary.csv'), 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Run', 'Power', 'Catalyst', 'Duration', 'Start', 'Seconds', 'Channel', 'Peak', 'Peak time',
+                         'Max heating rate (C/s)', 'Mean heating rate to peak (C/s)', 'NaN readings']
+                        + [f'Seconds >= {threshold:g} C' for threshold in thresholds])
+        for summary in summaries:
+            for name, channel in summary['channels'].items():
+                writer.writerow([summary['name'], summary['power'], summary['catalyst'], summary['duration'],
+                                 summary['start'], round(summary['duration_seconds'], 1), name, channel['peak'],
+                                 channel['peak_time'], channel['max_heating_rate'],
+                                 channel['mean_heating_rate_to_peak'], channel['nan_readings']]
+                                + list(channel['seconds_above'].values()))
+
+
+# --- Batch ---
+
+def segment_jobs(run, output_dir, segment_seconds):
+    # Split the run's video into segments of about `segment_seconds`
+    import cv2
+    capture = cv2.VideoCapture(run['video'])
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    capture.release()
+    if frame_count <= 0:
+        return []
+    times = frame_times(run['video'], frame_count, fps, run['log'])
+    frame_count = len(times)
+    per_segment = max(int(segment_seconds * fps), 1)
+    return [(run['video'], run['log'], os.path.join(output_dir, f"{run['name']}_overlay.part{i:04d}.mp4"),
+             start, min(start + per_segment, frame_count), times[start:start + per_segment])
+            for i, start in enumerate(range(0, frame_count, per_segment))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', default=['.'], help="Directories to search for runs, or video files")
+    parser.add_argument('--output-dir', default='postprocessed')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--segment-seconds', type=float, default=60.0, help="Video seconds per parallel job")
+    parser.add_argument('--threshold', type=float, action='append', help="°C; time above it is summarized "
+                        "(repeatable, default 100, 200 and 300)")
+    parser.add_argument('--summary-only', action='store_true', help="Skip the overlay videos")
+    parser.add_argument('--include-active', action='store_true', help="Also process runs still being recorded")
+    parser.add_argument('--force', action='store_true', help="Re-render overlay videos that already exist")
+    args = parser.parse_args()
+    thresholds = sorted(args.threshold or [100.0, 200.0, 300.0])
+
+    runs = find_runs(args.paths, args.include_active)
+    if not runs:
+        print("No runs found.")
+        return
+    os.makedirs(args.output_dir, exist_ok=True)
+    started = time.perf_counter()
+    print(f"Processing {len(runs)} runs with {args.workers} workers.")
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        summary_futures = [pool.submit(summarize, run, thresholds) for run in runs]
+
+        segment_futures = {}  # Future -> run name
+        parts = {}  # Run name -> segment files, in order
+        for run in runs:
+            output = os.path.join(args.output_dir, f"{run['name']}_overlay.mp4")
+            if args.summary_only or (os.path.exists(output) and not args.force):
+                continue
+            jobs = segment_jobs(run, args.output_dir, args.segment_seconds)
+            parts[run['name']] = [job[2] for job in jobs]
+            for job in jobs:
+                segment_futures[pool.submit(render_segment, *job)] = run['name']
+
+        remaining = {name: len(files) for name, files in parts.items()}
+        for future in as_completed(segment_futures):
+            name = segment_futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error rendering a segment of {name}: {e}")
+            remaining[name] -= 1
+            if remaining[name] == 0:
+                output = os.path.join(args.output_dir, f"{name}_overlay.mp4")
+                concatenate(parts[name], output)
+                print(f"Rendered {output}")
+
+        summaries = []
+        for run, future in zip(runs, summary_futures):
+            try:
+                summaries.append(future.result())
+            except Exception as e:
+                print(f"Error summarizing {run['name']}: {e}")
+
+    write_summaries(summaries, args.output_dir, thresholds)
+    print(f"Wrote {len(summaries)} summaries to {args.output_dir} in {time.perf_counter() - started:.1f} s.")
+
+
+if __name__ == '__main__':
+    main()
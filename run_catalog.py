@@ -0,0 +1,149 @@
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    power TEXT,
+    catalyst TEXT,
+    duration TEXT,
+    state TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    last_access REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    size INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class RunCatalog:
+    """
+    Persistent SQLite catalog of logging runs: their files and sizes, parameters
+    and state ('active' or 'finished'). Retention works from the catalog alone,
+    never by listing the directory, and only ever deletes finished runs. Runs
+    are evicted, least recently used first, while the catalogued files exceed
+    `disk_budget_bytes` or the disk has less than `min_free_bytes` left. Runs
+    older than `max_age_seconds` are evicted regardless, if a maximum age is set.
+    """
+    def __init__(self, path, disk_budget_bytes=2 * 1024**3, min_free_bytes=512 * 1024**2, max_age_seconds=None):
+        self.path = path
+        self.disk_budget_bytes = disk_budget_bytes
+        self.min_free_bytes = min_free_bytes
+        self.max_age_seconds = max_age_seconds
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+        self.recover_interrupted_runs()
+
+    def recover_interrupted_runs(self):
+        # Runs still marked active were cut short by a restart; they are finished now
+        with self.lock:
+            run_ids = [row['id'] for row in self.db.execute("SELECT id FROM runs WHERE state = 'active'")]
+        for run_id in run_ids:
+            self.finish_run(run_id)
+
+    def start_run(self, paths, power=None, catalyst=None, duration=None):
+        now = time.time()
+        paths = [os.path.abspath(path) for path in paths]
+        with self.lock, self.db:
+            # Re-using a file name hands the file over to the new run
+            self.db.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in paths])
+            self.db.execute("DELETE FROM runs WHERE state != 'active' AND id NOT IN (SELECT run_id FROM files)")
+            run_id = self.db.execute(
+                "INSERT INTO runs (power, catalyst, duration, state, started_at, last_access) "
+                "VALUES (?, ?, ?, 'active', ?, ?)", (power, catalyst, duration, now, now)).lastrowid
+            self.db.executemany("INSERT INTO files (path, run_id) VALUES (?, ?)", [(path, run_id) for path in paths])
+        return run_id
+
+    def finish_run(self, run_id):
+        with self.lock, self.db:
+            paths = [row['path'] for row in self.db.execute("SELECT path FROM files WHERE run_id = ?", (run_id,))]
+            self.db.executemany("UPDATE files SET size = ? WHERE path = ?", [(file_size(path), path) for path in paths])
+            self.db.execute("UPDATE runs SET state = 'finished', finished_at = ? WHERE id = ?", (time.time(), run_id))
+
+    def touch(self, path):
+        # Record an access (e.g. a download) so the run counts as recently used
+        with self.lock, self.db:
+            self.db.execute("UPDATE runs SET last_access = ? WHERE id = (SELECT run_id FROM files WHERE path = ?)",
+                            (time.time(), os.path.abspath(path)))
+
+    def runs(self):
+        with self.lock:
+            runs = [dict(row) for row in self.db.execute("SELECT * FROM runs ORDER BY started_at DESC")]
+            for run in runs:
+                run['files'] = {row['path']: row['size'] for row in
+                                self.db.execute("SELECT path, size FROM files WHERE run_id = ?", (run['id'],))}
+        return runs
+
+    def used_bytes(self):
+        # Finished runs use their recorded sizes; only the (few) files of active runs are stat'ed
+        with self.lock:
+            finished = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM files JOIN runs ON runs.id = run_id "
+                                       "WHERE state = 'finished'").fetchone()[0]
+            active = [row['path'] for row in self.db.execute("SELECT path FROM files JOIN runs ON runs.id = run_id "
+                                                             "WHERE state = 'active'")]
+        return finished + sum(file_size(path) for path in active)
+
+    def enforce_retention(self):
+        now = time.time()
+        used = self.used_bytes()
+        free = shutil.disk_usage(os.path.dirname(os.path.abspath(self.path))).free
+        with self.lock:
+            candidates = [dict(row) for row in self.db.execute(
+                "SELECT runs.id, runs.started_at, COALESCE(SUM(size), 0) AS size FROM runs "
+                "LEFT JOIN files ON runs.id = run_id WHERE state = 'finished' "
+                "GROUP BY runs.id ORDER BY last_access ASC, started_at ASC")]
+
+        for run in candidates:
+            too_old = self.max_age_seconds is not None and now - run['started_at'] > self.max_age_seconds
+            over_budget = used > self.disk_budget_bytes or free < self.min_free_bytes
+            if not (too_old or over_budget):
+                continue
+            self.remove_run(run['id'])
+            used -= run['size']
+            free += run['size']
+
+    def remove_run(self, run_id):
+        with self.lock, self.db:
+            paths = [row['path'] for row in self.db.execute("SELECT path FROM files WHERE run_id = ?", (run_id,))]
+            for path in paths:
+                try:
+                    os.remove(path)
+                    print(f"Removed old file: {path}")
+                except FileNotFoundError:
+                    pass
+                except Exception as e:
+                    print(f"Error while deleting file {path}: {e}")
+            self.db.execute("DELETE FROM files WHERE run_id = ?", (run_id,))
+            self.db.execute("DELETE FROM runs WHERE id = ?", (run_id,))
+
+
+def active_files(path):
+    # Files of runs still marked active, read without opening (and so recovering) the catalog
+    if not os.path.exists(path):
+        return set()
+    try:
+        db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            return {row[0] for row in db.execute("SELECT path FROM files JOIN runs ON runs.id = run_id "
+                                                 "WHERE state = 'active'")}
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return set()
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
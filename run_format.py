@@ -0,0 +1,139 @@
+import os
+import struct
+from datetime import datetime
+
+import numpy as np
+
+from thermistor import CALIBRATED_COEFFICIENTS, codes_to_temperature
+
+# Run file layout: a 64-byte header followed by fixed-width little-endian records of
+#   int64 epoch nanoseconds | float32 raw ADC code per thermistor channel | float32 thermocouple °C
+# Codes are stored raw (averaged when oversampled), so a run can be re-converted with new
+# calibration coefficients at any time.
+HEADER = struct.Struct('<8sHHd3d20x')
+MAGIC = b'MWRUN\x00\x00\x00'
+VERSION = 1
+
+
+def run_path(log_file_name):
+    return os.path.splitext(log_file_name)[0] + '.mwrun'
+
+
+def record_dtype(channels):
+    return np.dtype([('time_ns', '<i8'), ('codes', '<f4', (channels,)), ('thermocouple', '<f4')])
+
+
+def csv_header(channels):
+    return ['Timestamp'] + [f'Thermistor{i+1}' for i in range(channels)] + ['Thermocouple', 'Comment']
+
+
+# Timestamps get millisecond resolution unless samples are at least 2 s apart. With a 1 s period,
+# jitter around a second boundary would otherwise give two rows the same timestamp, and rows
+# (and their comments) are keyed by timestamp.
+def millisecond_timestamps(sample_period):
+    return sample_period < 2
+
+
+def format_timestamp(time_ns, sample_period):
+    now = datetime.fromtimestamp(time_ns / 1e9)
+    if millisecond_timestamps(sample_period):
+        return now.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    return now.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def parse_timestamp(value):
+    # Accepts epoch seconds or the '%Y-%m-%d %H:%M:%S[.fff]' timestamps used in the sensor log
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    timestamp_format = '%Y-%m-%d %H:%M:%S.%f' if '.' in value else '%Y-%m-%d %H:%M:%S'
+    return datetime.strptime(value, timestamp_format).timestamp()
+
+
+def check_run_file(path, channels, sample_period):
+    # Raises ValueError if `path` holds a run that new records with these settings can't be appended to
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb') as file:
+        data = file.read(HEADER.size)
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is not a complete run file")
+    magic, version, file_channels, file_period, *_ = HEADER.unpack(data)
+    if (magic, version) != (MAGIC, VERSION):
+        raise ValueError(f"{path} is not a supported run file")
+    if (file_channels, file_period) != (channels, sample_period):
+        raise ValueError(f"{path} was recorded with {file_channels} channels every {file_period:g} s; "
+                         f"use another run name for {channels} channels every {sample_period:g} s")
+
+
+class RunWriter:
+    """
+    Appends records to a run file. A run started again with the same name appends
+    to the same file, as the CSV log always has; `first_record` is where this
+    run's records begin. Raises ValueError if the file was written with other
+    channels or another sample period.
+    """
+    def __init__(self, path, channels, sample_period, coefficients=CALIBRATED_COEFFICIENTS):
+        check_run_file(path, channels, sample_period)
+        self.record = struct.Struct(f'<q{channels}ff')
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(HEADER.pack(MAGIC, VERSION, channels, sample_period, *coefficients))
+            self.file.flush()
+        self.first_record = (self.file.tell() - HEADER.size) // self.record.size
+
+    def append(self, time_ns, codes, thermocouple_temp):
+        # Flushed per record so readers always see complete samples of the active run
+        self.file.write(self.record.pack(time_ns, *codes, thermocouple_temp))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class RunReader:
+    """
+    Zero-copy reader for a run file: the records are memory-mapped as a NumPy
+    structured array, so slicing by index costs nothing until the data is used.
+    Call refresh() to pick up records appended to an active run.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            magic, version, self.channels, self.sample_period, *coefficients = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a supported run file")
+        self.coefficients = tuple(coefficients)
+        self.dtype = record_dtype(self.channels)
+        self.records = None
+        self.refresh()
+
+    def refresh(self):
+        count = (os.path.getsize(self.path) - HEADER.size) // self.dtype.itemsize
+        if count == 0:
+            self.records = np.empty(0, dtype=self.dtype)
+        elif self.records is None or count != len(self.records):
+            self.records = np.memmap(self.path, dtype=self.dtype, mode='r', offset=HEADER.size, shape=(count,))
+        return self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def temperatures(self, records, coefficients=None):
+        # Thermistor temperatures of `records`, optionally with different calibration coefficients
+        return codes_to_temperature(records['codes'], coefficients or self.coefficients)
+
+    def rows(self, start=0, stop=None, coefficients=None, chunk_size=4096):
+        # Yield the records as CSV-style rows (without the header), converting one chunk at a time
+        stop = len(self.records) if stop is None else min(stop, len(self.records))
+        for chunk_start in range(start, stop, chunk_size):
+            chunk = self.records[chunk_start:min(chunk_start + chunk_size, stop)]
+            temperatures = self.temperatures(chunk, coefficients).tolist()
+            thermocouple = np.round(chunk['thermocouple'].astype(np.float64), 2).tolist()
+            for time_ns, readings, thermocouple_temp in zip(chunk['time_ns'].tolist(), temperatures, thermocouple):
+                yield [format_timestamp(time_ns, self.sample_period)] + readings + [thermocouple_temp, '']
+
+    def csv_rows(self, coefficients=None):
+        yield csv_header(self.channels)
+        yield from self.rows(coefficients=coefficients)
@@ -0,0 +1,133 @@
+import csv
+import os
+from bisect import bisect_right
+
+import numpy as np
+
+from comment_journal import CommentJournal, merged_rows
+from run_format import RunReader, csv_header, millisecond_timestamps, parse_timestamp, run_path
+
+# Sparse index sidecar of a CSV sensor log: one "epoch_seconds,byte_offset" line for every
+# `INDEX_EVERY` rows, so a time range read can seek close to its first row instead of scanning.
+INDEX_EVERY = 64
+
+
+def index_path(log_file_name):
+    return log_file_name + '.idx'
+
+
+class SparseIndexWriter:
+    """Appends index entries while log_data writes the CSV log."""
+    def __init__(self, log_file_name, every=INDEX_EVERY):
+        self.file = open(index_path(log_file_name), 'a')
+        self.every = every
+        self.rows = 0
+
+    def add(self, time_s, offset):
+        # `offset` is the byte position the row starts at
+        if self.rows % self.every == 0:
+            self.file.write(f"{time_s:.3f},{offset}\n")
+            self.file.flush()
+        self.rows += 1
+
+    def close(self):
+        self.file.close()
+
+
+def load_index(log_file_name, every=INDEX_EVERY):
+    """
+    Return (times, offsets) of the sparse index. Archived logs without an index
+    are scanned once and the index is saved next to them.
+    """
+    times, offsets = [], []
+    try:
+        with open(index_path(log_file_name)) as file:
+            for line in file:
+                time_s, offset = line.split(',')
+                times.append(float(time_s))
+                offsets.append(int(offset))
+        return times, offsets
+    except FileNotFoundError:
+        pass
+
+    with open(log_file_name, 'rb') as file:
+        file.readline()  # Header
+        row = 0
+        while True:
+            offset = file.tell()
+            line = file.readline()
+            if not line:
+                break
+            if row % every == 0:
+                times.append(parse_timestamp(line.split(b',', 1)[0].decode()))
+                offsets.append(offset)
+            row += 1
+    with open(index_path(log_file_name), 'w') as file:
+        file.writelines(f"{time_s:.3f},{offset}\n" for time_s, offset in zip(times, offsets))
+    return times, offsets
+
+
+def read_csv_range(log_file_name, start=None, end=None):
+    # Yield the header, then the CSV rows with start <= timestamp <= end
+    times, offsets = load_index(log_file_name)
+    with open(log_file_name, 'rb') as file:
+        yield next(csv.reader([file.readline().decode()]))
+        if start is not None and times:
+            position = bisect_right(times, start) - 1
+            if position >= 0:
+                file.seek(offsets[position])
+        for line in file:
+            if not line.endswith(b'\n'):
+                break  # Row still being written
+            row = next(csv.reader([line.decode()]))
+            if not row:
+                continue
+            time_s = parse_timestamp(row[0])
+            if start is not None and time_s < start:
+                continue
+            if end is not None and time_s > end:
+                break
+            yield row
+
+
+def read_run_range(path, start=None, end=None):
+    # Yield the header, then the rows of a binary run file in the range, located by binary search
+    reader = RunReader(path)
+    yield csv_header(reader.channels)
+    times = reader.records['time_ns']
+
+    # Bounds apply to the timestamps as written to the log, which are truncated to
+    # whole seconds (or milliseconds for periods under 2 s)
+    resolution_ns = 1_000_000 if millisecond_timestamps(reader.sample_period) else 1_000_000_000
+    lo, hi = 0, len(times)
+    if start is not None:
+        start_ns = -(-round(start * 1e6) * 1000 // resolution_ns) * resolution_ns
+        lo = int(np.searchsorted(times, start_ns, side='left'))
+    if end is not None:
+        end_ns = (round(end * 1e6) * 1000 // resolution_ns + 1) * resolution_ns
+        hi = int(np.searchsorted(times, end_ns, side='left'))
+    yield from reader.rows(lo, hi)
+
+
+def read_range(log_file_name, start=None, end=None, channels=None):
+    """
+    Stream the rows of a run between `start` and `end` (epoch seconds, inclusive),
+    with comments merged in and optionally restricted to `channels` (header names).
+    Uses the binary run file when there is one and the indexed CSV log otherwise,
+    so it works for the active run and for archived runs alike.
+    """
+    if os.path.exists(run_path(log_file_name)):
+        rows = read_run_range(run_path(log_file_name), start, end)
+    else:
+        rows = read_csv_range(log_file_name, start, end)
+    rows = merged_rows(rows, CommentJournal(log_file_name).load())
+
+    header = next(rows)
+    columns = [0] + [header.index(channel) for channel in channels if channel in header] if channels else None
+    if columns is None:
+        yield header
+        yield from rows
+    else:
+        yield [header[i] for i in columns]
+        for row in rows:
+            yield [row[i] for i in columns]
@@ -0,0 +1,124 @@
+import json
+import threading
+from collections import deque
+
+
+class SampleBuffer:
+    """
+    Bounded, thread-safe ring buffer holding the most recent sensor samples.
+    Every sample gets a monotonically increasing sequence number, which keeps
+    growing across runs so clients can tell old samples from new ones.
+    """
+    def __init__(self, capacity=600):
+        self.samples = deque(maxlen=capacity)  # (seq, row) pairs, oldest first
+        self.last_seq = 0
+        self.run_start_seq = 0  # last_seq at the moment the current run started
+        self.lock = threading.Lock()
+
+    def append(self, row):
+        with self.lock:
+            self.last_seq += 1
+            self.samples.append((self.last_seq, row))
+            return self.last_seq
+
+    def latest(self, count=10):
+        # Index from the right end of the deque so this stays O(count)
+        with self.lock:
+            count = min(count, len(self.samples))
+            return [self.samples[-i][1] for i in range(count, 0, -1)]
+
+    def tail(self, count):
+        # Return (rows, last_seq) for the newest `count` samples, read under one lock
+        with self.lock:
+            count = min(count, len(self.samples))
+            return [self.samples[-i][1] for i in range(count, 0, -1)], self.last_seq
+
+    def since(self, seq):
+        """
+        Return (rows, last_seq, truncated) for every sample logged after `seq`.
+        `truncated` is True when some of the requested samples already fell out of the buffer.
+        A cursor ahead of the buffer (a page left open across a server restart) or from
+        before the current run is reset: the whole buffer comes back, marked truncated.
+        """
+        with self.lock:
+            if seq > self.last_seq or seq < self.run_start_seq:
+                return [row for _, row in self.samples], self.last_seq, True
+            count = min(self.last_seq - seq, len(self.samples))
+            rows = [self.samples[-i][1] for i in range(count, 0, -1)]
+            oldest_seq = self.samples[0][0] if self.samples else self.last_seq + 1
+            return rows, self.last_seq, seq + 1 < oldest_seq
+
+    def clear(self):
+        # Drop the samples of the previous run but keep the sequence counter
+        with self.lock:
+            self.samples.clear()
+            self.run_start_seq = self.last_seq
+
+
+def format_sample(timestamp, readings):
+    # Round once at ingest so readers never have to re-parse or re-round
+    return [timestamp] + [f"{value:.2f}" for value in readings]
+
+
+class Subscription:
+    """
+    Per-client bounded queue of pre-serialized messages. When a client falls
+    behind, the oldest messages are dropped instead of piling up in memory.
+    """
+    def __init__(self, max_pending=50):
+        self.messages = deque(maxlen=max_pending)
+        self.condition = threading.Condition()
+        self.dropped = 0
+
+    def put(self, message):
+        with self.condition:
+            if len(self.messages) == self.messages.maxlen:
+                self.dropped += 1
+            self.messages.append(message)
+            self.condition.notify()
+
+    def get_all(self, timeout=None):
+        # Block until at least one message is pending, then hand back everything queued
+        with self.condition:
+            if not self.messages:
+                self.condition.wait(timeout)
+            messages = list(self.messages)
+            self.messages.clear()
+            return messages
+
+
+class SampleHub:
+    """
+    Fan-out hub that pushes every new sample to all subscribed clients as a
+    Server-Sent Event. The event is serialized once per sample, however many
+    clients are listening.
+    """
+    def __init__(self, max_pending=50):
+        self.max_pending = max_pending
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        subscription = Subscription(self.max_pending)
+        with self.lock:
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def client_count(self):
+        with self.lock:
+            return len(self.subscribers)
+
+    def publish(self, seq, run, row):
+        message = sse_event(seq, run, row)
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            subscription.put(message)
+
+
+def sse_event(seq, run, row):
+    return f"id: {seq}\ndata: {json.dumps({'seq': seq, 'run': run, 'row': row})}\n\n"
@@ -0,0 +1,68 @@
+import math
+import threading
+import time
+
+
+class PeriodicScheduler:
+    """
+    Runs a task at fixed deadlines on the monotonic clock, so the period does not
+    drift by however long the task itself takes. When the task overruns, the late
+    tick runs straight away; ticks that were missed entirely are either skipped
+    ('skip') or run back to back ('catch_up').
+    Lateness against each deadline is recorded as jitter.
+    """
+    def __init__(self, period, missed_ticks='skip'):
+        if not (math.isfinite(period) and period > 0):
+            raise ValueError(f"Invalid sample period {period}")  # NaN deadlines would sample non-stop
+        self.period = period
+        self.missed_ticks = missed_ticks
+        self.stop_event = threading.Event()
+
+        self.ticks = 0
+        self.overruns = 0  # Ticks whose task ran past the next deadline
+        self.skipped_ticks = 0
+        self.last_jitter = 0.0
+        self.max_jitter = 0.0
+        self.total_jitter = 0.0
+
+    def run(self, task):
+        # Blocks until stop() is called
+        next_deadline = time.monotonic()
+        while not self.stop_event.is_set():
+            delay = next_deadline - time.monotonic()
+            if delay > 0 and self.stop_event.wait(delay):
+                break
+
+            jitter = time.monotonic() - next_deadline
+            self.last_jitter = jitter
+            self.max_jitter = max(self.max_jitter, jitter)
+            self.total_jitter += jitter
+            self.ticks += 1
+
+            try:
+                task()
+            except Exception as e:
+                print(f"Error in scheduled task: {e}")
+
+            next_deadline += self.period
+            behind = time.monotonic() - next_deadline
+            if behind > 0:
+                self.overruns += 1
+                missed = int(behind // self.period)
+                if missed and self.missed_ticks == 'skip':
+                    self.skipped_ticks += missed
+                    next_deadline += missed * self.period
+
+    def stop(self):
+        self.stop_event.set()
+
+    def stats(self):
+        return {
+            'period': self.period,
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'skipped_ticks': self.skipped_ticks,
+            'last_jitter': self.last_jitter,
+            'max_jitter': self.max_jitter,
+            'mean_jitter': self.total_jitter / self.ticks if self.ticks else 0.0,
+        }
@@ -0,0 +1,247 @@
+import math
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+from comment_journal import read_rows
+from run_format import RunReader, parse_timestamp
+from thermistor import lookup_table
+
+# Simulated MCP3008, MAX6675 and camera, so the service runs (and can be benchmarked) off the Pi.
+# hardware.py selects them when MW_HARDWARE=sim. The MW_SIM_* variables below set the defaults;
+# `config` can also be changed at runtime, before the first read.
+config = {
+    'adc_latency': float(os.environ.get('MW_SIM_ADC_LATENCY', 0.00005)),  # Seconds per MCP3008 transfer
+    'adc_noise': float(os.environ.get('MW_SIM_ADC_NOISE', 1.5)),  # Std dev in ADC codes
+    'thermocouple_latency': float(os.environ.get('MW_SIM_THERMOCOUPLE_LATENCY', 0.0001)),
+    'thermocouple_noise': float(os.environ.get('MW_SIM_THERMOCOUPLE_NOISE', 0.25)),  # Std dev in °C
+    'sensor_replay': os.environ.get('MW_SIM_SENSOR_REPLAY'),  # .mwrun or CSV sensor log to play back
+    'camera_fps': float(os.environ.get('MW_SIM_CAMERA_FPS', 30)),
+    'camera_width': int(os.environ.get('MW_SIM_CAMERA_WIDTH', 640)),
+    'camera_height': int(os.environ.get('MW_SIM_CAMERA_HEIGHT', 480)),
+    'camera_noise': float(os.environ.get('MW_SIM_CAMERA_NOISE', 6)),  # Std dev in pixel levels
+    'camera_replay': os.environ.get('MW_SIM_CAMERA_REPLAY'),  # Video file to play back in a loop
+}
+
+
+# --- Sensor sources ---
+
+class SyntheticSensors:
+    """Slowly drifting thermistor codes and a heating/cooling thermocouple cycle."""
+    def __init__(self, channels=8):
+        self.channels = channels
+        self.start = time.monotonic()
+
+    def sample(self):
+        # Returns (ADC code per channel, thermocouple °C) at the current time
+        t = time.monotonic() - self.start
+        codes = [300 + 40 * channel + 60 * math.sin(2 * math.pi * t / 300 + channel) for channel in range(self.channels)]
+        thermocouple = 25 + 175 * (1 - math.cos(2 * math.pi * t / 600)) / 2
+        return codes, thermocouple
+
+
+class ReplaySensors:
+    """
+    Plays a recorded run back in real time (scaled by `speed`), looping at the
+    end. Binary run files replay their raw codes; CSV logs are mapped back to
+    the nearest code of the calibrated conversion table.
+    """
+    def __init__(self, path, speed=1.0):
+        if path.endswith('.mwrun'):
+            reader = RunReader(path)
+            self.codes = np.array(reader.records['codes'], dtype=np.float64)
+            self.thermocouple = np.array(reader.records['thermocouple'], dtype=np.float64)
+            self.period = reader.sample_period
+        else:
+            rows = list(read_rows(path))[1:]
+            temperatures = np.array([[float(value) for value in row[1:-2]] for row in rows])
+            table = np.nan_to_num(lookup_table(), nan=np.inf)
+            self.codes = np.abs(table[None, None, :] - temperatures[:, :, None]).argmin(axis=2).astype(np.float64)
+            self.thermocouple = np.array([float(row[-2]) for row in rows])
+            times = [parse_timestamp(row[0]) for row in rows[:2]]
+            self.period = times[1] - times[0] if len(times) == 2 and times[1] > times[0] else 2.0
+        if not len(self.codes):
+            raise ValueError(f"{path} has no samples to replay")
+        self.speed = speed
+        self.start = time.monotonic()
+
+    def sample(self):
+        index = int((time.monotonic() - self.start) * self.speed / self.period) % len(self.codes)
+        return self.codes[index].tolist(), float(self.thermocouple[index])
+
+
+sensor_source = None
+sensor_source_lock = threading.Lock()
+
+
+def sensors():
+    # Shared by both SPI devices, so the thermistors and the thermocouple stay in step
+    global sensor_source
+    with sensor_source_lock:
+        if sensor_source is None:
+            path = config['sensor_replay']
+            sensor_source = ReplaySensors(path) if path else SyntheticSensors()
+        return sensor_source
+
+
+# --- spidev / RPi.GPIO stand-ins ---
+
+class SpiDev:
+    """
+    Drop-in for spidev.SpiDev: device 0 answers as the MCP3008 and device 1 as
+    the MAX6675, with the configured transfer latency and noise.
+    """
+    def __init__(self):
+        self.bus = None
+        self.device = None
+        self.max_speed_hz = 0
+        self.transfers = 0
+
+    def open(self, bus, device):
+        self.bus, self.device = bus, device
+
+    def xfer2(self, data):
+        self.transfers += 1
+        if self.device == 0:
+            return self.mcp3008(data)
+        return self.max6675()
+
+    def mcp3008(self, data):
+        if config['adc_latency'] > 0:
+            time.sleep(config['adc_latency'])
+        channel = (data[1] >> 4) & 7
+        codes, _ = sensors().sample()
+        code = codes[channel] if channel < len(codes) else 0
+        code = min(max(int(round(code + random.gauss(0, config['adc_noise']))), 0), 1023)
+        return [0, (code >> 8) & 3, code & 0xFF]
+
+    def max6675(self):
+        if config['thermocouple_latency'] > 0:
+            time.sleep(config['thermocouple_latency'])
+        _, temperature = sensors().sample()
+        if math.isnan(temperature):
+            raw = 0x4  # Open thermocouple input
+        else:
+            temperature += random.gauss(0, config['thermocouple_noise'])
+            raw = min(max(int(temperature / 0.25), 0), 0xFFF) << 3
+        return [(raw >> 8) & 0xFF, raw & 0xFF]
+
+    def close(self):
+        self.device = None
+
+
+class SimulatedGPIO:
+    BCM = 11
+    OUT = 0
+    LOW = 0
+    HIGH = 1
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction):
+        pass
+
+    def output(self, pin, value):
+        pass
+
+    def cleanup(self):
+        pass
+
+
+GPIO = SimulatedGPIO()
+
+
+# --- Camera ---
+
+class SimulatedCamera:
+    """
+    Stand-in for cv2.VideoCapture that delivers frames at the configured frame
+    rate: a moving test pattern with noise, or a video file played in a loop.
+    """
+    def __init__(self, fps=None, width=None, height=None, noise=None, replay=None):
+        import cv2  # Only needed when a camera is simulated
+        self.fps = fps or config['camera_fps']
+        self.replay = replay or config['camera_replay']
+        self.source = None
+        if self.replay:
+            self.source = cv2.VideoCapture(self.replay)
+            if not self.source.isOpened():
+                raise ValueError(f"Cannot open {self.replay} for replay")
+            width = width or int(self.source.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = height or int(self.source.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.width = width or config['camera_width']
+        self.height = height or config['camera_height']
+        noise = config['camera_noise'] if noise is None else noise
+
+        # Noise is pre-generated and cycled, so it costs an add per frame rather than an RNG pass
+        rng = np.random.default_rng(0)
+        self.noise = [rng.normal(0, noise, (self.height, self.width, 3)).clip(0, 255).astype(np.uint8)
+                      for _ in range(4)] if noise > 0 else []
+        gradient = np.linspace(40, 200, self.width, dtype=np.uint8)
+        self.background = np.dstack([np.tile(gradient, (self.height, 1))] * 3)
+
+        self.frames = 0
+        self.next_frame_time = None
+        self.opened = True
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        import cv2
+        if not self.opened:
+            return False, None
+
+        # Block until the next frame is due, like a real camera
+        now = time.monotonic()
+        if self.next_frame_time is None:
+            self.next_frame_time = now
+        elif now < self.next_frame_time:
+            time.sleep(self.next_frame_time - now)
+        self.next_frame_time = max(self.next_frame_time + 1.0 / self.fps, now - 1.0 / self.fps)
+
+        frame = self.replay_frame() if self.source is not None else self.pattern_frame()
+        if self.noise:
+            frame = cv2.add(frame, self.noise[self.frames % len(self.noise)])
+        self.frames += 1
+        return True, frame
+
+    def pattern_frame(self):
+        import cv2
+        frame = self.background.copy()
+        x = int(self.frames * 4 % self.width)
+        frame[:, x:x + 16] = 255
+        cv2.putText(frame, f"{self.frames} {time.strftime('%H:%M:%S')}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX,
+                    0.8, (0, 0, 255), 2)
+        return frame
+
+    def replay_frame(self):
+        import cv2
+        success, frame = self.source.read()
+        if not success:
+            self.source.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            success, frame = self.source.read()
+            if not success:
+                return self.background.copy()
+        if frame.shape[1] != self.width or frame.shape[0] != self.height:
+            frame = cv2.resize(frame, (self.width, self.height))
+        return frame
+
+    def get(self, prop):
+        import cv2
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.fps)
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        return 0.0
+
+    def release(self):
+        self.opened = False
+        if self.source is not None:
+            self.source.release()
@@ -0,0 +1,71 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+
+ADC_CODES = 1024  # The MCP3008 is a 10-bit ADC
+V_REF = 3.3  # Reference voltage for the ADC
+R_FIXED = 10000  # 10k fixed resistor
+
+# Steinhart-Hart coefficients (a, b, c) for the 10k thermistor
+DATASHEET_COEFFICIENTS = (1.123760013e-3, 2.330409748e-4, 1.073440972e-7)  # From datasheet
+CALIBRATED_COEFFICIENTS = (-0.3080782548e-3, 4.895032621e-4, -10.75680830e-7)  # From calibration
+
+
+# Convert a raw 10-bit ADC code to voltage
+def code_to_voltage(code):
+    return (code * V_REF) / ADC_CODES
+
+
+# Function to convert voltage to temperature for thermistors
+def voltage_to_temperature(voltage, coefficients=CALIBRATED_COEFFICIENTS):
+    if voltage <= 0:  # Check if voltage is valid
+        return float('NaN')  # Return NaN to avoid division by zero
+
+    try:
+        # Calculate the resistance of the thermistor
+        R_thermistor = R_FIXED * (V_REF / voltage - 1)
+        lnohm = math.log(R_thermistor)
+    except ValueError:
+        return float('NaN')  # Return NaN if log fails (negative ohms)
+
+    a, b, c = coefficients
+    t1 = b * lnohm
+    t2 = c * lnohm**3
+    temp_k = 1 / (a + t1 + t2)  # Temperature in Kelvin
+    temp_c = temp_k - 273.15  # Convert Kelvin to Celsius
+
+    return round(temp_c, 2)  # Return temperature with 2 decimal places
+
+
+@lru_cache(maxsize=16)
+def lookup_table(coefficients=CALIBRATED_COEFFICIENTS):
+    """
+    Temperature for every possible ADC code under one set of coefficients.
+    The table is built with the scalar conversion, so lookups match it exactly,
+    NaN cases included. Tables are cached per coefficient tuple.
+    """
+    table = np.array([voltage_to_temperature(code_to_voltage(code), coefficients) for code in range(ADC_CODES)])
+    table.flags.writeable = False  # Shared between callers through the cache
+    return table
+
+
+def codes_to_temperature(codes, coefficients=CALIBRATED_COEFFICIENTS):
+    """
+    Convert an array of raw ADC codes (any shape) to temperatures in °C.
+    Integer codes are looked up in the per-calibration table. Fractional codes,
+    e.g. averaged oversamples, go through a vectorized Steinhart-Hart that
+    returns NaN wherever the scalar conversion does.
+    """
+    codes = np.asarray(codes)
+    if np.issubdtype(codes.dtype, np.integer):
+        return lookup_table(tuple(coefficients))[codes]
+
+    voltage = code_to_voltage(codes.astype(np.float64))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_thermistor = R_FIXED * (V_REF / voltage - 1)
+        lnohm = np.log(r_thermistor)
+        a, b, c = coefficients
+        temp_c = 1 / (a + b * lnohm + c * lnohm**3) - 273.15
+    temp_c = np.where((voltage <= 0) | ~(r_thermistor > 0), np.nan, temp_c)
+    return np.round(temp_c, 2)